@@ -16,11 +16,48 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
+    # jsonify and Socket.IO share one encoder, orjson when it is installed
+    from app import serializers
+    app.json = serializers.FastJSONProvider(app)
+    
+    from app import log
+    log.init_app(app)
+    
     # Initialize extensions with app
+    from app import database
+    database.configure(app)
     db.init_app(app)
+    database.init_app(app, db)
     login_manager.init_app(app)
-    migrate.init_app(app, db)
-    socketio.init_app(app, cors_allowed_origins="*")
+    # The search index has no model, keep autogenerate from dropping it
+    from app.search import include_object
+    migrate.init_app(app, db, include_object=include_object)
+    
+    # Share rooms between server processes through the configured message queue
+    from app.socketqueue import client_manager
+    socketio.init_app(app, cors_allowed_origins="*", json=serializers, client_manager=client_manager(
+        app.config['SOCKETIO_MESSAGE_QUEUE'], app.config['SOCKETIO_CHANNEL'], json=serializers))
+    
+    from app.cache import identity_cache
+    identity_cache.init_app(app)
+    
+    from app.fragments import fragment_cache
+    fragment_cache.init_app(app)
+    
+    from app.graph import graph
+    graph.init_app(app)
+    
+    from app.dedupe import message_dedupe
+    message_dedupe.init_app(app)
+    
+    from app import metrics
+    metrics.init_app(app)
+    
+    from app import ingest, outbox, archive, enrich
+    enrich.init_app(app)
+    ingest.workers.init_app(app)
+    outbox.workers.init_app(app)
+    archive.scheduler.init_app(app)
     
     # Register blueprints
     from app.routes.auth import auth as auth_bp
@@ -33,6 +70,9 @@ def create_app(config_class=Config):
     app.register_blueprint(integration_bp)
     app.register_blueprint(api_bp)
     
+    from app.commands import register_commands
+    register_commands(app)
+    
     return app
 
 from app import models
@@ -0,0 +1,182 @@
+"""Retention tiering: cold conversations move their messages to compressed archive storage.
+
+A conversation that has not been updated for ARCHIVE_AFTER_DAYS days (or
+ARCHIVE_CLOSED_AFTER_DAYS once it is closed) has its messages serialized
+to JSON, compressed and stored as a single message_archive row, and they
+are deleted from the message table that serves the live dashboard. The
+conversation row and its summary stay where they are, so the conversation
+list is unchanged. Opening an archived conversation restores its messages
+first, so reads work as before.
+
+Archiving runs from `flask archive-conversations` and, in a server
+process, every ARCHIVE_INTERVAL seconds in the background.
+"""
+import json
+import threading
+import zlib
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import DateTime, and_, exists, or_
+from app import db, search, socketio, stats
+from app.log import get_logger
+from app.models import Conversation, Message, MessageArchive
+from app.workers import WorkerPool, run_task
+
+log = get_logger('archive')
+
+COMPRESSION_LEVEL = 9
+
+_lock = threading.Lock()
+_counters = {'runs': 0, 'archived_conversations': 0, 'archived_messages': 0, 'restored_conversations': 0,
+             'restored_messages': 0, 'raw_bytes': 0, 'compressed_bytes': 0, 'last_run_at': None}
+
+def encode_messages(messages):
+    """Compressed JSON of the messages' column values, returning (data, raw size)"""
+    rows = []
+    for message in messages:
+        row = {}
+        for column in Message.__table__.columns:
+            value = getattr(message, column.key)
+            row[column.name] = value.isoformat() if isinstance(value, datetime) else value
+        rows.append(row)
+    raw = json.dumps(rows, separators=(',', ':')).encode()
+    return zlib.compress(raw, COMPRESSION_LEVEL), len(raw)
+
+def decode_messages(data):
+    """Message instances from archived data"""
+    columns = Message.__table__.columns
+    dates = {column.name for column in columns if isinstance(column.type, DateTime)}
+    return [Message(**{
+        columns[name].key: datetime.fromisoformat(value) if name in dates and value else value
+        for name, value in row.items() if name in columns
+    }) for row in json.loads(zlib.decompress(data))]
+
+def idle_since(cutoff):
+    """Conversations neither updated nor restored from the archive since cutoff"""
+    return and_(Conversation.updated_at < cutoff,
+                or_(Conversation.restored_at.is_(None), Conversation.restored_at < cutoff))
+
+def cold_conversations(now, after_id, limit):
+    """Conversations due for archiving, in id order after after_id"""
+    config = current_app.config
+    idle_cutoff = now - timedelta(days=config['ARCHIVE_AFTER_DAYS'])
+    closed_cutoff = now - timedelta(days=config['ARCHIVE_CLOSED_AFTER_DAYS'])
+    # Replies still on their way to Facebook keep a conversation live
+    undelivered = exists().where(
+        Message.conversation_id == Conversation.id,
+        Message.status.in_(['pending', 'sending'])
+    )
+    return Conversation.query.filter(
+        Conversation.id > after_id,
+        Conversation.archived_at.is_(None),
+        Conversation.message_count > 0,
+        or_(idle_since(idle_cutoff), and_(Conversation.status == 'closed', idle_since(closed_cutoff))),
+        ~undelivered
+    ).order_by(Conversation.id).limit(limit).with_for_update(skip_locked=True).all()
+
+def archive_cold_conversations(batch_size=None):
+    """Archive every conversation due for it, one batch per transaction, returning the number archived"""
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    now = datetime.utcnow()
+    last_id, archived = 0, 0
+    while True:
+        conversations = cold_conversations(now, last_id, batch_size)
+        if not conversations:
+            break
+        last_id = conversations[-1].id
+        archived += archive_conversations([conversation.id for conversation in conversations], now)
+
+    with _lock:
+        _counters['runs'] += 1
+        _counters['last_run_at'] = now.isoformat()
+    return archived
+
+def archive_conversations(conversation_ids, now):
+    """Move the messages of the given conversations to the archive and commit"""
+    messages = {}
+    for message in Message.query.filter(Message.conversation_id.in_(conversation_ids)) \
+            .order_by(Message.conversation_id, Message.seq, Message.id):
+        messages.setdefault(message.conversation_id, []).append(message)
+
+    archives, raw_bytes, compressed_bytes = [], 0, 0
+    for conversation_id, conversation_messages in messages.items():
+        data, raw_size = encode_messages(conversation_messages)
+        archives.append(MessageArchive(conversation_id=conversation_id, message_count=len(conversation_messages),
+                                       raw_size=raw_size, data=data, archived_at=now))
+        raw_bytes += raw_size
+        compressed_bytes += len(data)
+
+    archived_messages = [message for conversation_messages in messages.values() for message in conversation_messages]
+    search.unindex_messages(archived_messages)
+    db.session.add_all(archives)
+    # Deleting by id leaves alone a reply written while the batch was being archived; a restore merges them
+    Message.query.filter(Message.id.in_([message.id for message in archived_messages])) \
+        .delete(synchronize_session=False)
+    # The conversation keeps its place in the list, and a new message from the customer starts a new one
+    Conversation.query.filter(Conversation.id.in_(list(messages))).update(
+        {'archived_at': now, 'active_key': None, 'updated_at': Conversation.updated_at}, synchronize_session=False)
+    db.session.commit()
+    # The deleted messages are of no further use, do not keep them around between batches
+    for message in archived_messages:
+        db.session.expunge(message)
+
+    with _lock:
+        _counters['archived_conversations'] += len(archives)
+        _counters['archived_messages'] += len(archived_messages)
+        _counters['raw_bytes'] += raw_bytes
+        _counters['compressed_bytes'] += compressed_bytes
+    log.info('conversations_archived', conversations=len(archives), messages=len(archived_messages),
+             raw_bytes=raw_bytes, compressed_bytes=compressed_bytes)
+    return len(archives)
+
+def restore(conversation_id):
+    """Move an archived conversation's messages back to the message table and commit, returning how many
+
+    The conditional update lets a single request restore the conversation
+    when several open it at once; on server databases the others wait for
+    it on the row lock and then read the restored messages.
+    """
+    claimed = Conversation.query.filter(
+        Conversation.id == conversation_id,
+        Conversation.archived_at.isnot(None)
+    ).update({'archived_at': None, 'restored_at': datetime.utcnow(), 'updated_at': Conversation.updated_at},
+             synchronize_session=False)
+    if not claimed:
+        db.session.rollback()
+        return 0
+
+    archive = MessageArchive.query.filter_by(conversation_id=conversation_id).first()
+    messages = decode_messages(archive.data) if archive else []
+    db.session.add_all(messages)
+    if archive:
+        db.session.delete(archive)
+    db.session.flush()
+    search.index_messages(messages)
+    db.session.commit()
+
+    with _lock:
+        _counters['restored_conversations'] += 1
+        _counters['restored_messages'] += len(messages)
+    log.info('conversation_restored', conversation_id=conversation_id, messages=len(messages))
+    return len(messages)
+
+def _scheduler(app, index):
+    """Archive cold conversations every ARCHIVE_INTERVAL seconds"""
+    interval = app.config['ARCHIVE_INTERVAL']
+
+    with app.app_context():
+        while True:
+            socketio.sleep(interval)
+            # Another process may be archiving the same rows; the next run picks up what is left
+            run_task(log, 'archive_error', archive_cold_conversations)
+
+scheduler = WorkerPool(_scheduler, 'ARCHIVE_INTERVAL', tasks=1)
+
+def archive_stats():
+    with _lock:
+        counters = dict(_counters)
+    counters['compression_ratio'] = counters['raw_bytes'] / counters['compressed_bytes'] \
+        if counters['compressed_bytes'] else 0.0
+    return counters
+
+stats.register('archive', archive_stats)
@@ -0,0 +1,201 @@
+"""In-process identity cache for rows read on every webhook and send.
+
+Facebook pages, customers and the immutable parts of conversations almost
+never change, so they are cached as read-only snapshots instead of being
+queried for every event. Entries are evicted by age (TTL) and by size (LRU),
+and the routes that modify these rows invalidate them explicitly. Pages can
+also change in another process (a server or store_token.py), so page
+lookups compare the pages' row count and latest updated_at with the
+database every few seconds and drop the cache when they differ.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from sqlalchemy import func
+from app import db, stats
+from app.models import FacebookPage, Customer, Conversation
+
+PageRef = namedtuple('PageRef', 'id page_id page_name access_token user_id is_active')
+CustomerRef = namedtuple('CustomerRef', 'id fb_id name profile_pic')
+ConversationRef = namedtuple('ConversationRef', 'id fb_page_id customer_id')
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a fixed TTL"""
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+
+class IdentityCache:
+    """Cache of page, customer and conversation snapshots keyed by natural and primary keys"""
+
+    def __init__(self):
+        self._cache = TTLCache()
+        self.check_interval = 5
+        self.page_changes = 0
+        self._pages_version = None
+        self._checked_at = 0.0
+        self._check_lock = threading.Lock()
+
+    def init_app(self, app):
+        self._cache = TTLCache(
+            maxsize=app.config['IDENTITY_CACHE_SIZE'],
+            ttl=app.config['IDENTITY_CACHE_TTL']
+        )
+        self.check_interval = app.config['IDENTITY_CACHE_CHECK_INTERVAL']
+
+    def check_pages(self):
+        """Drop the cache if any page changed in the database, checking at most once per check_interval"""
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        # One thread checks, the others keep using the cache meanwhile
+        if not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            version = tuple(db.session.query(func.count(FacebookPage.id), func.max(FacebookPage.updated_at)).one())
+            if self._pages_version is not None and version != self._pages_version:
+                self._cache.clear()
+                self.page_changes += 1
+            self._pages_version = version
+            self._checked_at = time.monotonic()
+        finally:
+            self._check_lock.release()
+
+    def page_ref(self, page):
+        """Snapshot a FacebookPage and cache it under its page_id and primary key"""
+        ref = PageRef(page.id, page.page_id, page.page_name, page.access_token,
+                      page.user_id, page.is_active)
+        self._cache.set(('page', ref.id), ref)
+        self._cache.set(('page_id', ref.page_id), ref)
+        return ref
+
+    def customer_ref(self, customer):
+        """Snapshot a Customer and cache it under its fb_id and primary key"""
+        ref = CustomerRef(customer.id, customer.fb_id, customer.name, customer.profile_pic)
+        self._cache.set(('customer', ref.id), ref)
+        self._cache.set(('fb_id', ref.fb_id), ref)
+        return ref
+
+    def conversation_ref(self, conversation):
+        """Snapshot the immutable columns of a Conversation"""
+        ref = ConversationRef(conversation.id, conversation.fb_page_id, conversation.customer_id)
+        self._cache.set(('conversation', ref.id), ref)
+        return ref
+
+    def get_page(self, id):
+        self.check_pages()
+        ref = self._cache.get(('page', id))
+        if ref is None:
+            page = db.session.get(FacebookPage, id)
+            ref = self.page_ref(page) if page else None
+        return ref
+
+    def get_customer(self, id):
+        ref = self._cache.get(('customer', id))
+        if ref is None:
+            customer = db.session.get(Customer, id)
+            ref = self.customer_ref(customer) if customer else None
+        return ref
+
+    def get_conversation(self, id):
+        ref = self._cache.get(('conversation', id))
+        if ref is None:
+            conversation = db.session.get(Conversation, id)
+            ref = self.conversation_ref(conversation) if conversation else None
+        return ref
+
+    def get_pages_by_page_id(self, page_ids):
+        """Return {page_id: PageRef} for the known pages, loading misses with one query"""
+        self.check_pages()
+        found, missing = self._lookup_many('page_id', page_ids)
+        if missing:
+            for page in FacebookPage.query.filter(FacebookPage.page_id.in_(missing)):
+                found[page.page_id] = self.page_ref(page)
+        return found
+
+    def get_customers_by_fb_id(self, fb_ids):
+        """Return {fb_id: CustomerRef} for the known customers, loading misses with one query"""
+        found, missing = self._lookup_many('fb_id', fb_ids)
+        if missing:
+            for customer in Customer.query.filter(Customer.fb_id.in_(missing)):
+                found[customer.fb_id] = self.customer_ref(customer)
+        return found
+
+    def invalidate_page(self, page):
+        self._cache.delete(('page', page.id))
+        self._cache.delete(('page_id', page.page_id))
+
+    def invalidate_customer(self, customer):
+        self._cache.delete(('customer', customer.id))
+        self._cache.delete(('fb_id', customer.fb_id))
+
+    def invalidate_conversation(self, conversation):
+        self._cache.delete(('conversation', conversation.id))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return dict(self._cache.stats(), page_changes=self.page_changes)
+
+    def _lookup_many(self, kind, keys):
+        found, missing = {}, []
+        for key in keys:
+            ref = self._cache.get((kind, key))
+            if ref is None:
+                missing.append(key)
+            else:
+                found[key] = ref
+        return found, missing
+
+identity_cache = IdentityCache()
+
+stats.register('identity_cache', lambda: identity_cache.stats())
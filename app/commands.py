@@ -0,0 +1,72 @@
+"""Flask CLI commands for maintenance tasks"""
+import click
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+from app import db, archive, search
+from app.models import Conversation, Message
+
+def register_commands(app):
+    app.cli.add_command(backfill_summaries)
+    app.cli.add_command(search_rebuild)
+    app.cli.add_command(archive_conversations)
+
+@click.command('backfill-summaries')
+@click.option('--batch-size', default=1000, show_default=True, help='conversations updated per transaction')
+def backfill_summaries(batch_size):
+    """Recompute the denormalized message summary of every conversation that is not archived"""
+    latest = select(Message).where(Message.conversation_id == Conversation.id) \
+        .order_by(Message.timestamp.desc(), Message.id.desc()).limit(1)
+    agent_message = aliased(Message)
+    last_agent_reply = select(func.max(agent_message.timestamp)).where(
+        agent_message.conversation_id == Conversation.id,
+        agent_message.sender_type == 'agent'
+    ).scalar_subquery()
+
+    values = {
+        'last_message_text': func.substr(
+            latest.with_only_columns(Message.message_text).scalar_subquery(), 1, 255),
+        'last_message_at': latest.with_only_columns(Message.timestamp).scalar_subquery(),
+        'last_sender_type': latest.with_only_columns(Message.sender_type).scalar_subquery(),
+        # message_count also numbers new messages, so it continues from the last one
+        'message_count': select(func.coalesce(func.max(Message.seq), 0))
+            .where(Message.conversation_id == Conversation.id).scalar_subquery(),
+        # Customer messages since the last agent reply count as unread
+        'unread_count': select(func.count(Message.id)).where(
+            Message.conversation_id == Conversation.id,
+            Message.sender_type == 'customer',
+            (last_agent_reply.is_(None)) | (Message.timestamp > last_agent_reply)
+        ).scalar_subquery(),
+        # Keep the list order and the 24h window as they are
+        'updated_at': Conversation.updated_at
+    }
+
+    last_id, updated = 0, 0
+    while True:
+        # Archived messages are not in the message table, archived conversations keep the summary they had
+        ids = [id for (id,) in db.session.query(Conversation.id)
+               .filter(Conversation.id > last_id, Conversation.archived_at.is_(None))
+               .order_by(Conversation.id).limit(batch_size)]
+        if not ids:
+            break
+
+        Conversation.query.filter(Conversation.id.in_(ids)).update(values, synchronize_session=False)
+        db.session.commit()
+        last_id, updated = ids[-1], updated + len(ids)
+        click.echo(f"Backfilled {updated} conversations")
+
+    click.echo(f"Done, {updated} conversations updated")
+
+@click.command('search-rebuild')
+def search_rebuild():
+    """Rebuild the SQLite message search index from the message table"""
+    if search.rebuild():
+        click.echo("Search index rebuilt")
+    else:
+        click.echo("This database keeps its full-text index up to date itself, nothing to rebuild")
+
+@click.command('archive-conversations')
+@click.option('--batch-size', type=int, help='conversations archived per transaction (default ARCHIVE_BATCH_SIZE)')
+def archive_conversations(batch_size):
+    """Move the messages of cold conversations to compressed archive storage"""
+    archived = archive.archive_cold_conversations(batch_size)
+    click.echo(f"Done, {archived} conversations archived")
@@ -0,0 +1,64 @@
+"""Engine settings per database backend.
+
+DATABASE_PROFILE 'auto' tunes the engine for the configured database:
+
+- SQLite: every new connection switches to WAL (readers no longer block the
+  writer), waits SQLITE_BUSY_TIMEOUT_MS for the write lock instead of
+  failing with "database is locked", relaxes fsyncs to synchronous=NORMAL
+  (safe with WAL) and memory-maps the file.
+- MySQL and PostgreSQL: a sized connection pool whose connections are
+  checked before use and recycled before the server drops them.
+
+'plain' leaves the driver defaults, as before these settings existed.
+SQLALCHEMY_ENGINE_OPTIONS set in the config override the profile's options.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the profile and database of a config"""
+    if config['DATABASE_PROFILE'] == 'plain':
+        return {}
+
+    backend = make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+    if backend == 'sqlite':
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True
+    }
+
+def configure(app):
+    """Merge the profile's engine options into the app config before the engines are created"""
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(engine_options(app.config),
+                                                   **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+
+def init_app(app, db):
+    """Apply connection pragmas to the app's SQLite engines"""
+    if app.config['DATABASE_PROFILE'] == 'plain':
+        return
+
+    synchronous = app.config['SQLITE_SYNCHRONOUS'].upper()
+    if synchronous not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        raise ValueError(f"Unknown SQLITE_SYNCHRONOUS {synchronous}")
+    pragmas = [
+        'PRAGMA journal_mode=WAL',
+        f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}",
+        f"PRAGMA synchronous={synchronous}",
+        f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}"
+    ]
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', set_pragmas)
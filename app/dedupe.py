@@ -0,0 +1,78 @@
+"""Idempotent webhook processing keyed on the Facebook message mid.
+
+Facebook re-delivers a webhook when it does not get an answer in time, so
+the same message can arrive several times. Messages store their mid under
+a unique index; before a batch is processed its mids are checked against
+the mids this process saw recently and then against the database, and
+events already stored are dropped before any lookups or emits.
+"""
+import threading
+from app import db, stats
+from app.cache import TTLCache
+from app.models import Message
+
+class MessageDeduplicator:
+    """Recently seen mids in memory, backed by the unique index on Message.mid"""
+
+    def __init__(self):
+        self._recent = TTLCache()
+        self._lock = threading.Lock()
+        self._counters = {'checked': 0, 'duplicates_memory': 0, 'duplicates_database': 0}
+
+    def init_app(self, app):
+        self._recent = TTLCache(
+            maxsize=app.config['WEBHOOK_DEDUPE_SIZE'],
+            ttl=app.config['WEBHOOK_DEDUPE_TTL']
+        )
+
+    def claim(self, events):
+        """Drop (page, event) pairs whose message was already stored
+
+        Returns the remaining events and the mids claimed for them. The
+        claimed mids are treated as seen straight away so a concurrent
+        re-delivery is dropped too; release them if processing fails.
+        """
+        fresh, claimed, duplicates = [], [], 0
+        with self._lock:
+            for page, event in events:
+                mid = (event.get('message') or {}).get('mid')
+                if mid is None:
+                    fresh.append((page, event))
+                elif self._recent.get(mid) is not None:
+                    duplicates += 1
+                else:
+                    self._recent.set(mid, True)
+                    claimed.append(mid)
+                    fresh.append((page, event))
+            self._counters['checked'] += len(claimed) + duplicates
+            self._counters['duplicates_memory'] += duplicates
+
+        if not claimed:
+            return fresh, claimed
+
+        # Messages stored by another process or before a restart
+        stored = {mid for (mid,) in db.session.query(Message.mid).filter(Message.mid.in_(claimed))}
+        if stored:
+            with self._lock:
+                self._counters['duplicates_database'] += len(stored)
+            fresh = [(page, event) for page, event in fresh
+                     if (event.get('message') or {}).get('mid') not in stored]
+            claimed = [mid for mid in claimed if mid not in stored]
+        return fresh, claimed
+
+    def release(self, mids):
+        """Forget claimed mids whose messages were not stored"""
+        for mid in mids:
+            self._recent.delete(mid)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        duplicates = counters['duplicates_memory'] + counters['duplicates_database']
+        counters['duplicate_rate'] = duplicates / counters['checked'] if counters['checked'] else 0.0
+        counters['recent'] = self._recent.stats()['size']
+        return counters
+
+message_dedupe = MessageDeduplicator()
+
+stats.register('webhook_dedupe', message_dedupe.stats)
@@ -0,0 +1,127 @@
+"""Background enrichment of customer profiles from the Graph API.
+
+New customers are stored with a placeholder name so their messages are not
+held up by a profile fetch. The fetch runs on a small worker pool and is
+single-flight per customer: a burst of events from one new sender results
+in a single Graph call. Agents of the pages the customer talks to are told
+about the new name and picture with a customer_update Socket.IO event.
+"""
+import queue
+import threading
+from flask import current_app
+from app import db, realtime, stats
+from app.cache import TTLCache, identity_cache
+from app.fragments import fragment_cache
+from app.graph import graph
+from app.log import get_logger
+from app.models import Conversation, Customer
+from app.workers import WorkerPool, run_task
+
+PLACEHOLDER_NAME = 'Unknown User'
+
+log = get_logger('enrich')
+
+_pending = queue.Queue()
+_inflight = set()
+_backoff = TTLCache()
+_lock = threading.Lock()
+_counters = {'requested': 0, 'deduplicated': 0, 'fetched': 0, 'empty': 0, 'failed': 0}
+
+def init_app(app):
+    """Keep customers whose fetch failed or came back empty in backoff for PROFILE_ENRICH_RETRY_AFTER seconds"""
+    global _backoff
+    _backoff = TTLCache(ttl=app.config['PROFILE_ENRICH_RETRY_AFTER'])
+
+def needs_profile(customer):
+    """Whether a customer still carries the placeholder profile"""
+    return customer.name == PLACEHOLDER_NAME and not customer.profile_pic
+
+def request_profile(customer, access_token):
+    """Schedule a profile fetch unless one is already running for this customer"""
+    with _lock:
+        _counters['requested'] += 1
+        if customer.fb_id in _inflight or _backoff.get(customer.fb_id):
+            _counters['deduplicated'] += 1
+            return False
+        _inflight.add(customer.fb_id)
+
+    app = current_app._get_current_object()
+    if workers.enabled(app):
+        workers.start(app)
+        _pending.put((customer.id, customer.fb_id, access_token))
+    else:
+        enrich_customer(customer.id, customer.fb_id, access_token)
+
+    return True
+
+def _worker(app, index):
+    """Fetch queued profiles one at a time"""
+    with app.app_context():
+        while True:
+            customer_id, fb_id, access_token = _pending.get()
+            run_task(log, 'enrich_error', enrich_customer, customer_id, fb_id, access_token, fb_id=fb_id)
+
+workers = WorkerPool(_worker, 'PROFILE_ENRICH_WORKERS')
+
+def enrich_customer(customer_id, fb_id, access_token):
+    """Fetch a customer's profile, store it and notify connected agents"""
+    try:
+        response = graph.get(fb_id, 'user_profile', params={
+            'fields': 'name,profile_pic',
+            'access_token': access_token
+        })
+        user_data = response.json()
+        if response.status_code != 200 or user_data.get('error'):
+            raise ValueError(user_data.get('error', {}).get('message', 'profile fetch failed'))
+
+        customer = db.session.get(Customer, customer_id)
+        if not customer:
+            return
+        customer.name = user_data.get('name') or PLACEHOLDER_NAME
+        customer.profile_pic = user_data.get('profile_pic', '')
+        empty = needs_profile(customer)
+        customer_data = {
+            'id': customer.id,
+            'fb_id': customer.fb_id,
+            'name': customer.name,
+            'profile_pic': customer.profile_pic
+        }
+        conversations = db.session.query(Conversation.id, Conversation.fb_page_id) \
+            .filter_by(customer_id=customer_id).all()
+        rooms = list({realtime.page_room(fb_page_id) for _, fb_page_id in conversations})
+        db.session.commit()
+        identity_cache.invalidate_customer(customer)
+        # The customer's name and picture appear in the list items of their conversations
+        fragment_cache.invalidate([conversation_id for conversation_id, _ in conversations])
+
+        # Without a name or picture the customer keeps the placeholder and would be fetched
+        # again on every message, so an empty profile waits out the same backoff as a failure
+        if empty:
+            _backoff.set(fb_id, True)
+            with _lock:
+                _counters['empty'] += 1
+    except Exception as e:
+        db.session.rollback()
+        log.error('profile_fetch_failed', fb_id=fb_id, error=str(e))
+        _backoff.set(fb_id, True)
+        with _lock:
+            _counters['failed'] += 1
+        return
+    finally:
+        with _lock:
+            _inflight.discard(fb_id)
+
+    if not empty:
+        _backoff.delete(fb_id)
+    with _lock:
+        _counters['fetched'] += 1
+
+    # Only the agents of pages the customer talks to see them
+    realtime.emit('customer_update', customer_data, rooms)
+
+def enrichment_stats():
+    with _lock:
+        return dict(_counters, inflight=len(_inflight), queued=_pending.qsize(), backoff=_backoff.stats()['size'],
+                    workers=workers.started)
+
+stats.register('profile_enrichment', enrichment_stats)
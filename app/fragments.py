@@ -0,0 +1,128 @@
+"""Rendered conversation list items, cached between dashboard loads.
+
+Each conversation's list item is cached under its id together with a
+version made of everything the item shows (updated_at, last message,
+unread count, customer name and picture). A cached item is used only while
+its version still matches the row, so the dashboard re-renders just the
+conversations that changed. The write paths also invalidate the items they
+touch, so they are not kept around once they can no longer be used.
+
+The cache lives in process memory by default; with FRAGMENT_CACHE_URL set
+to a redis:// URL it is shared by every server process. The same versions
+give GET /api/conversations its ETag.
+"""
+import hashlib
+import json
+import threading
+from flask import current_app
+from markupsafe import Markup
+from app import stats
+from app.cache import TTLCache
+
+ITEM_TEMPLATE = 'dashboard/conversation_item.html'
+
+def conversation_version(conversation):
+    """The values of a conversation that its list item and list entry are rendered from"""
+    customer = conversation.customer
+    return '|'.join(str(value) for value in (
+        conversation.id, conversation.updated_at.isoformat(), conversation.status,
+        conversation.last_message_text, conversation.last_sender_type, conversation.message_count,
+        conversation.unread_count, customer.name, customer.profile_pic
+    ))
+
+def list_etag(conversations, *extra):
+    """ETag of a page of the conversation list"""
+    digest = hashlib.sha1()
+    for part in [conversation_version(conversation) for conversation in conversations] + list(extra):
+        digest.update(str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def render_item(conversation, active=False):
+    return Markup(current_app.jinja_env.get_template(ITEM_TEMPLATE).render(
+        conversation=conversation, active=active))
+
+class RedisBackend:
+    """Fragments shared by every server process through Redis, expiring after ttl seconds"""
+
+    def __init__(self, url, ttl, prefix='helpdesk:fragment:'):
+        # Only needed when configured, like the Socket.IO Redis queue
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        value = self._redis.get(f"{self.prefix}{key}")
+        return json.loads(value) if value is not None else default
+
+    def set(self, key, value):
+        self._redis.set(f"{self.prefix}{key}", json.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self._redis.delete(f"{self.prefix}{key}")
+
+    def clear(self):
+        for key in self._redis.scan_iter(f"{self.prefix}*"):
+            self._redis.delete(key)
+
+    def stats(self):
+        return {'backend': 'redis', 'ttl': self.ttl}
+
+def backend(url, maxsize, ttl):
+    """Return the fragment store for a cache URL, process memory when it is empty"""
+    if not url:
+        return TTLCache(maxsize=maxsize, ttl=ttl)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url, ttl)
+    raise ValueError(f"Unsupported FRAGMENT_CACHE_URL {url}")
+
+class FragmentCache:
+    """Conversation list items keyed by conversation id, valid while their version matches"""
+
+    def __init__(self):
+        self._backend = TTLCache()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'rendered': 0, 'stale': 0, 'invalidated': 0}
+
+    def init_app(self, app):
+        self._backend = backend(app.config['FRAGMENT_CACHE_URL'], app.config['FRAGMENT_CACHE_SIZE'],
+                                app.config['FRAGMENT_CACHE_TTL'])
+
+    def render(self, conversation):
+        """The list item of a conversation, from the cache unless the conversation changed"""
+        version = conversation_version(conversation)
+        cached = self._backend.get(conversation.id)
+        if cached is not None and cached[0] == version:
+            self._count('hits')
+            return Markup(cached[1])
+
+        html = render_item(conversation)
+        self._backend.set(conversation.id, [version, str(html)])
+        self._count('stale' if cached is not None else 'rendered')
+        return html
+
+    def invalidate(self, conversation_ids):
+        """Drop the items of conversations whose list entry just changed"""
+        for conversation_id in conversation_ids:
+            self._backend.delete(conversation_id)
+            self._count('invalidated')
+
+    def clear(self):
+        self._backend.clear()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        renders = counters['rendered'] + counters['stale']
+        counters['hit_ratio'] = counters['hits'] / (counters['hits'] + renders) if counters['hits'] + renders else 0.0
+        counters['backend'] = self._backend.stats()
+        return counters
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+fragment_cache = FragmentCache()
+
+stats.register('fragment_cache', fragment_cache.stats)
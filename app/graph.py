@@ -0,0 +1,158 @@
+"""Shared client for the Facebook Graph API.
+
+All Graph calls go through one pooled keep-alive requests.Session so TLS
+connections are reused between requests. Every call has a timeout, and
+rate-limited or failed calls are retried with jittered exponential backoff
+that respects the delay Facebook asks for in its response headers.
+"""
+import json
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from app import stats
+from app.metrics import GRAPH_REQUEST_SECONDS
+
+# Graph error codes that signal throttling rather than a bad request
+RATE_LIMIT_ERROR_CODES = {4, 17, 32, 613, 80001, 80006}
+
+class GraphClient:
+    """Pooled Graph API client, configured from the app config by init_app"""
+
+    def __init__(self):
+        self.base_url = 'https://graph.facebook.com'
+        self.version = 'v18.0'
+        self.timeout = (3.05, 10)
+        self.max_retries = 3
+        self.backoff_base = 0.5
+        self.backoff_max = 8.0
+        self.session = self._make_session(10)
+        self._retries = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.base_url = app.config['GRAPH_API_URL'].rstrip('/')
+        self.version = app.config['GRAPH_API_VERSION']
+        self.timeout = (app.config['GRAPH_CONNECT_TIMEOUT'], app.config['GRAPH_READ_TIMEOUT'])
+        self.max_retries = app.config['GRAPH_MAX_RETRIES']
+        self.backoff_base = app.config['GRAPH_BACKOFF_BASE']
+        self.backoff_max = app.config['GRAPH_BACKOFF_MAX']
+        self.session = self._make_session(app.config['GRAPH_POOL_SIZE'])
+
+    def _make_session(self, pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def url(self, path):
+        return f"{self.base_url}/{self.version}/{path.lstrip('/')}"
+
+    def get(self, path, endpoint, **kwargs):
+        return self.request('GET', path, endpoint, **kwargs)
+
+    def post(self, path, endpoint, **kwargs):
+        return self.request('POST', path, endpoint, **kwargs)
+
+    def delete(self, path, endpoint, **kwargs):
+        return self.request('DELETE', path, endpoint, **kwargs)
+
+    def request(self, method, path, endpoint, idempotent=None, max_retries=None, **kwargs):
+        """Send a Graph request, retrying throttled and transient failures
+
+        endpoint is a short name used to label latency metrics. Requests that
+        are not idempotent (POST by default) are only retried when Facebook
+        rejected them outright: connection failures and rate limits.
+        max_retries overrides the client's limit for callers that retry themselves.
+        """
+        if idempotent is None:
+            idempotent = method != 'POST'
+        if max_retries is None:
+            max_retries = self.max_retries
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.url(path)
+
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._observe(endpoint, started, 'connection_error' if isinstance(e, requests.ConnectionError)
+                              else 'timeout')
+                retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+                if not retryable or attempt >= max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                self._observe(endpoint, started, response.status_code)
+                if attempt >= max_retries or not self._should_retry(response, idempotent):
+                    return response
+                delay = max(self._backoff(attempt), retry_after(response) or 0)
+                if delay > self.backoff_max:
+                    # Facebook wants us to back off longer than a request can wait
+                    return response
+
+            attempt += 1
+            with self._lock:
+                self._retries[endpoint] = self._retries.get(endpoint, 0) + 1
+            time.sleep(delay)
+
+    def _should_retry(self, response, idempotent):
+        if is_rate_limited(response):
+            return True
+        return idempotent and response.status_code >= 500
+
+    def _backoff(self, attempt):
+        # Full jitter keeps workers that failed together from retrying together
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _observe(self, endpoint, started, status):
+        GRAPH_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status=status)
+
+    def stats(self):
+        with self._lock:
+            return {'retries': dict(self._retries)}
+
+def is_rate_limited(response):
+    """Whether a Graph response is a throttling error"""
+    if response.status_code == 429:
+        return True
+    if response.status_code < 400:
+        return False
+    try:
+        data = response.json()
+    except ValueError:
+        return False
+    error = data.get('error') if isinstance(data, dict) else None
+    return isinstance(error, dict) and error.get('code') in RATE_LIMIT_ERROR_CODES
+
+def retry_after(response):
+    """Seconds Facebook asked us to wait, from Retry-After or the usage headers"""
+    header = response.headers.get('Retry-After')
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+
+    # X-Business-Use-Case-Usage reports minutes until access is regained
+    usage = response.headers.get('X-Business-Use-Case-Usage')
+    if usage:
+        try:
+            minutes = max(
+                entry.get('estimated_time_to_regain_access', 0)
+                for entries in json.loads(usage).values()
+                for entry in entries
+            )
+            return minutes * 60 if minutes else None
+        except (ValueError, AttributeError, TypeError):
+            pass
+
+    return None
+
+graph = GraphClient()
+
+stats.register('graph_api', lambda: graph.stats())
@@ -0,0 +1,137 @@
+"""Durable ingestion queue for Facebook webhook payloads.
+
+The webhook endpoint only stores the raw payload in the webhook_event table and
+returns straight away. A small pool of background workers claims the stored
+rows and runs them through the normal message processing path. The workers
+start with the first request or Socket.IO connection a server process
+handles, and while idle they pick up rows left pending by other processes or
+a restart and retry rows whose worker died.
+"""
+import json
+import queue
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func, or_
+from app import db, stats
+from app.log import get_logger
+from app.models import WebhookEvent
+from app.workers import WorkerPool, run_task
+
+log = get_logger('ingest')
+
+_pending = queue.Queue()
+
+def enqueue(payload):
+    """Persist a raw webhook payload and hand it to the worker pool"""
+    event = WebhookEvent(payload=payload)
+    db.session.add(event)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    if workers.enabled(app):
+        workers.start(app)
+        _pending.put(event.id)
+    else:
+        # No workers configured, drain inline (useful for local debugging)
+        process_event(event.id)
+
+    return event.id
+
+def _worker(app, index):
+    """Drain queued webhook events until the process exits"""
+    poll_interval = app.config['WEBHOOK_QUEUE_POLL_INTERVAL']
+
+    with app.app_context():
+        while True:
+            try:
+                event_id = _pending.get(timeout=poll_interval)
+            except queue.Empty:
+                # Pick up rows enqueued by other processes, left over from a restart or claimed by a dead worker
+                run_task(log, 'poll_error', _poll_pending, app)
+                continue
+
+            run_task(log, 'queue_error', process_event, event_id, event_id=event_id)
+
+workers = WorkerPool(_worker, 'WEBHOOK_QUEUE_WORKERS')
+
+def _poll_pending(app):
+    """Put pending rows that are not in the in-memory queue back into it"""
+    release_stale(app.config['WEBHOOK_QUEUE_STALE_AFTER'])
+    if not _pending.empty():
+        return
+
+    event_ids = db.session.query(WebhookEvent.id).filter(due(datetime.utcnow())) \
+        .order_by(WebhookEvent.id).limit(100).all()
+    for (event_id,) in event_ids:
+        _pending.put(event_id)
+
+def release_stale(stale_after):
+    """Make rows claimed by a worker that died before finishing them pending again"""
+    stale_cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    released = WebhookEvent.query.filter(
+        WebhookEvent.status == 'processing',
+        WebhookEvent.started_at < stale_cutoff
+    ).update({'status': 'pending'}, synchronize_session=False)
+    db.session.commit()
+    if released:
+        log.warning('stale_events_released', events=released)
+    return released
+
+def due(now):
+    """Pending rows whose retry delay, if any, is over"""
+    return (WebhookEvent.status == 'pending') & or_(WebhookEvent.retry_at.is_(None), WebhookEvent.retry_at <= now)
+
+def process_event(event_id):
+    """Claim a queued webhook event and process its payload"""
+    from app.routes.api import process_webhook_payload
+
+    # Claiming with a conditional update keeps two workers from taking the same row
+    now = datetime.utcnow()
+    claimed = WebhookEvent.query.filter(WebhookEvent.id == event_id, due(now)).update({
+        'status': 'processing',
+        'attempts': WebhookEvent.attempts + 1,
+        'started_at': now
+    }, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return
+
+    event = db.session.get(WebhookEvent, event_id)
+    try:
+        process_webhook_payload(json.loads(event.payload))
+    except Exception as e:
+        db.session.rollback()
+        event = db.session.get(WebhookEvent, event_id)
+        event.error = str(e)
+        # Without workers nothing polls for retries, so a payload that failed inline stays failed
+        if event.attempts >= current_app.config['WEBHOOK_QUEUE_MAX_ATTEMPTS'] or not workers.enabled(current_app):
+            event.status = 'failed'
+        else:
+            # Waiting out a backoff keeps a short lock or outage from using up every attempt at once
+            backoff = current_app.config['WEBHOOK_QUEUE_RETRY_BACKOFF'] * 2 ** (event.attempts - 1)
+            event.status = 'pending'
+            event.retry_at = datetime.utcnow() + timedelta(seconds=backoff)
+        db.session.commit()
+        log.warning('event_failed', event_id=event_id, attempts=event.attempts, status=event.status, error=event.error)
+        return
+
+    # Processed rows are not kept, failed ones stay behind for inspection
+    db.session.delete(event)
+    db.session.commit()
+
+def queue_stats():
+    """Queue depth and lag of the oldest pending event"""
+    counts = dict(db.session.query(WebhookEvent.status, func.count(WebhookEvent.id))
+                  .group_by(WebhookEvent.status).all())
+    oldest = db.session.query(func.min(WebhookEvent.received_at)) \
+        .filter(WebhookEvent.status.in_(['pending', 'processing'])).scalar()
+
+    return {
+        'depth': counts.get('pending', 0),
+        'processing': counts.get('processing', 0),
+        'failed': counts.get('failed', 0),
+        'lag_seconds': (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0,
+        'workers': workers.started
+    }
+
+stats.register('webhook_queue', queue_stats)
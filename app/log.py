@@ -0,0 +1,180 @@
+"""Structured, sampled logging that stays off the request path.
+
+Modules log named events with fields through get_logger(category):
+
+    log = get_logger('webhook')
+    log.info('webhook_received', bytes=len(body), entries=2)
+
+Records are put on a bounded in-memory queue and written to stderr by a
+listener thread, so a slow terminal or log shipper never blocks a request;
+when the queue is full records are dropped and counted. Info and debug
+events of busy categories can be sampled (LOG_SAMPLE_RATES), warnings and
+errors are always kept. Message bodies are wrapped in Payload, which is
+redacted and truncated only when the record is actually written.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import threading
+from datetime import datetime, timezone
+from app import stats
+
+ROOT = 'helpdesk'
+# Keys whose values are customer content or credentials
+REDACTED_KEYS = {'text', 'message_text', 'access_token', 'title', 'payload', 'url'}
+# Tokens inside free text, such as request URLs quoted in exception messages
+TOKEN_PATTERN = re.compile(r'(access_token|appsecret_proof|client_secret)=[^&\s\'"]+')
+
+_lock = threading.Lock()
+_counters = {}
+_sample_rates = {}
+_payload_max = 512
+_listener = None
+
+class Payload:
+    """A message body logged with its content redacted, rendered lazily"""
+
+    def __init__(self, data, limit=None):
+        self.data = data
+        self.limit = limit
+
+    def __str__(self):
+        text = json.dumps(redact(self.data), separators=(',', ':'))
+        return truncate(text, self.limit or _payload_max)
+
+def redact(data):
+    """A copy of data with the values of sensitive keys replaced by their length"""
+    if isinstance(data, dict):
+        return {
+            key: f"[{len(str(value))} chars]" if key in REDACTED_KEYS and value is not None else redact(value)
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [redact(value) for value in data]
+    return data
+
+def scrub(value):
+    """Mask credentials quoted in a string field"""
+    if isinstance(value, str) and '=' in value:
+        return TOKEN_PATTERN.sub(r'\1=[redacted]', value)
+    return value
+
+def truncate(text, limit):
+    return text if len(text) <= limit else f"{text[:limit]}...[{len(text) - limit} more]"
+
+class EventLogger:
+    """Logs named events with keyword fields for one category"""
+
+    def __init__(self, category):
+        self.category = category
+        self.logger = logging.getLogger(f"{ROOT}.{category}")
+
+    def log(self, level, event, exc_info=False, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        # Only routine events are sampled, problems are always kept
+        if level < logging.WARNING:
+            rate = _sample_rates.get(self.category, 1.0)
+            if rate < 1.0 and random.random() >= rate:
+                _count(self.category, 'sampled_out')
+                return
+        _count(self.category, 'logged')
+        self.logger.log(level, event, exc_info=exc_info,
+                        extra={'category': self.category, 'fields': fields})
+
+    def debug(self, event, **fields):
+        self.log(logging.DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(logging.ERROR, event, **fields)
+
+def get_logger(category):
+    return EventLogger(category)
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'category': getattr(record, 'category', record.name),
+            'event': record.getMessage()
+        }
+        entry.update((key, scrub(value)) for key, value in getattr(record, 'fields', {}).items())
+        if record.exc_text:
+            entry['exception'] = scrub(record.exc_text)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Readable key=value lines for local development"""
+
+    def format(self, record):
+        fields = ' '.join(f"{key}={scrub(value)}" for key, value in getattr(record, 'fields', {}).items())
+        line = f"{self.formatTime(record)} {record.levelname} {getattr(record, 'category', record.name)} " \
+               f"{record.getMessage()} {fields}".rstrip()
+        if record.exc_text:
+            line += '\n' + scrub(record.exc_text)
+        return line
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full"""
+
+    def prepare(self, record):
+        # Fields are formatted by the listener thread, only the exception needs rendering here
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _count(getattr(record, 'category', record.name), 'dropped')
+
+def init_app(app):
+    """Route the helpdesk loggers through a queue to stderr once per process"""
+    global _listener, _payload_max
+    _sample_rates.clear()
+    for entry in app.config['LOG_SAMPLE_RATES'].split(','):
+        category, _, rate = entry.strip().partition(':')
+        if category and rate:
+            _sample_rates[category] = float(rate)
+    _payload_max = app.config['LOG_PAYLOAD_MAX']
+
+    logger = logging.getLogger(ROOT)
+    logger.setLevel(app.config['LOG_LEVEL'].upper())
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(JSONFormatter() if app.config['LOG_FORMAT'] == 'json' else TextFormatter())
+    records = queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE'])
+    logger.addHandler(DroppingQueueHandler(records))
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, stream)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def _count(category, name):
+    with _lock:
+        counters = _counters.setdefault(category, {'logged': 0, 'sampled_out': 0, 'dropped': 0})
+        counters[name] += 1
+
+def logging_stats():
+    with _lock:
+        return {category: dict(counters) for category, counters in _counters.items()}
+
+stats.register('logging', logging_stats)
@@ -0,0 +1,266 @@
+"""Prometheus metrics for the hot paths, served at /metrics.
+
+Counters and histograms are kept in per-thread shards: a thread (or green
+thread) only ever writes its own shard, so recording a value takes no lock
+and metrics can stay on in production. A scrape adds the shards up. When a
+thread ends its shard is folded into a retired total so counters never go
+backwards. The numbers registered with app.stats for GET /api/stats are
+served as well, as the helpdesk_stats gauge.
+
+    events = Counter('webhook_events_total', 'Webhook events', ['result'])
+    events.inc(result='processed')
+    with WEBHOOK_STAGE_SECONDS.time(stage='commit'):
+        db.session.commit()
+"""
+import hmac
+import threading
+import time
+import weakref
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import db, socketio, stats
+from app.log import get_logger
+
+PREFIX = 'helpdesk_'
+
+log = get_logger('metrics')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Reentrant: a thread's shard can be retired by garbage collection while a scrape holds the lock
+_lock = threading.RLock()
+_metrics = []
+_shards = []
+_retired = {}
+
+class _ShardOwner:
+    """Lives as long as its thread; its finalizer retires the thread's shard"""
+
+class _Local(threading.local):
+    def __init__(self):
+        self.shard = {}
+        self.owner = _ShardOwner()
+        with _lock:
+            _shards.append(self.shard)
+        weakref.finalize(self.owner, _retire, self.shard)
+
+def _retire(shard):
+    with _lock:
+        _shards.remove(shard)
+        _merge(_retired, shard)
+
+def _merge(total, shard):
+    for key, value in shard.copy().items():
+        if isinstance(value, list):
+            merged = total.setdefault(key, [0] * len(value))
+            for i, item in enumerate(value):
+                merged[i] += item
+        else:
+            total[key] = total.get(key, 0) + value
+
+_local = _Local()
+
+def _collect():
+    """Sum of every shard, live and retired"""
+    with _lock:
+        total = {key: list(value) if isinstance(value, list) else value for key, value in _retired.items()}
+        for shard in list(_shards):
+            _merge(total, shard)
+    return total
+
+class Counter:
+    """Monotonic count, optionally split by labels"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return (self.name, tuple(map(labels.get, self.labelnames)))
+
+    def inc(self, amount=1, **labels):
+        shard = _local.shard
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def samples(self, total):
+        for (name, values), value in total.items():
+            if name == self.name:
+                yield self.name, dict(zip(self.labelnames, values)), value
+
+class Histogram(Counter):
+    """Distribution of observed values over fixed buckets, such as latencies in seconds"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = _local.shard
+        key = self._key(labels)
+        # Bucket counts (not cumulative), then the +Inf bucket is the count, then the sum
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-2] += 1
+        counts[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self, total):
+        for (name, values), counts in total.items():
+            if name != self.name:
+                continue
+            labels = dict(zip(self.labelnames, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", dict(labels, le=str(bound)), cumulative
+            yield f"{self.name}_bucket", dict(labels, le='+Inf'), counts[-2]
+            yield f"{self.name}_count", labels, counts[-2]
+            yield f"{self.name}_sum", labels, counts[-1]
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+class Gauge:
+    """Current values read by a callback at scrape time, as {label values tuple: value}"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames, callback):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        _metrics.append(self)
+
+    def samples(self, total):
+        for values, value in self.callback().items():
+            yield self.name, dict(zip(self.labelnames, values)), value
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    total = _collect()
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples(total):
+            if labels:
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+WEBHOOK_EVENTS = Counter('webhook_events_total', 'Messaging events by result (processed, failed, duplicate, invalid)',
+                         ['result'])
+WEBHOOK_STAGE_SECONDS = Histogram('webhook_stage_seconds', 'Time spent in each stage of storing a webhook batch',
+                                  ['stage'])
+GRAPH_REQUEST_SECONDS = Histogram('graph_request_seconds', 'Graph API call latency by endpoint and HTTP status',
+                                  ['endpoint', 'status'])
+HTTP_REQUEST_SECONDS = Histogram('http_request_seconds', 'Request latency by endpoint', ['endpoint', 'method'])
+HTTP_REQUEST_QUERIES = Histogram('http_request_queries', 'Database queries made by one request', ['endpoint'],
+                                 buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+DB_QUERIES = Counter('db_queries_total', 'Database queries by context (request or background)', ['context'])
+
+def _room_sockets():
+    """Sockets of this process in each page and conversation room"""
+    rooms = socketio.server.manager.rooms.get('/', {}) if socketio.server else {}
+    counts = {}
+    for room, participants in list(rooms.items()):
+        if room is None:
+            counts[('all',)] = len(participants)
+        elif isinstance(room, str) and room.startswith(('page_', 'conversation_')):
+            counts[(room,)] = len(participants)
+    return counts
+
+def _flatten(prefix, value):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(f"{prefix}.{key}" if prefix else str(key), item)
+    elif isinstance(value, (int, float)):
+        yield prefix, int(value) if isinstance(value, bool) else value
+
+def _runtime_stats():
+    """Every number reported by GET /api/stats, keyed by provider and dotted path
+
+    A provider that fails, such as a queue whose query hit a busy database, is
+    left out of the scrape rather than failing it.
+    """
+    values = {}
+    for name, provider in stats.providers():
+        try:
+            snapshot = provider()
+        except Exception as e:
+            db.session.rollback()
+            log.warning('stats_failed', provider=name, error=str(e))
+            continue
+        for path, value in _flatten('', snapshot):
+            values[(name, path)] = value
+    return values
+
+Gauge('stats', 'Values of the runtime statistics also served by GET /api/stats', ['provider', 'stat'],
+      _runtime_stats)
+
+Gauge('socketio_room_sockets', 'Connected sockets per room of this process ("all" for every socket)',
+      ['room'], _room_sockets)
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+        DB_QUERIES.inc(context='request')
+    else:
+        DB_QUERIES.inc(context='background')
+
+def _start_request():
+    g.request_started = time.perf_counter()
+
+def _finish_request(response):
+    endpoint = request.endpoint or 'unknown'
+    started = g.get('request_started')
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+    HTTP_REQUEST_QUERIES.observe(g.get('query_count', 0), endpoint=endpoint)
+    return response
+
+def metrics_view():
+    # Room and page labels are not for everyone, so without a token nobody may scrape
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        return "Metrics are disabled, set METRICS_TOKEN to enable them", 403
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode()):
+        return "Unauthorized", 401
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    """Serve /metrics and time every request of the app"""
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -35,6 +35,8 @@ class FacebookPage(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set on every change, so other processes notice new tokens and owners and drop their cached copies
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship with customer conversations
     conversations = db.relationship('Conversation', backref='page', lazy='dynamic')
@@ -62,11 +64,34 @@ class Conversation(db.Model):
     status = db.Column(db.String(20), default='open')  # open, closed
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # "<customer_id>:<fb_page_id>" while new messages from the customer go to this
+    # conversation, cleared once it falls out of the 24h window
+    active_key = db.Column(db.String(64), index=True, unique=True)
+    
+    # Summary of the latest messages, maintained by the write paths
+    last_message_text = db.Column(db.String(255))
+    last_message_at = db.Column(db.DateTime)
+    last_sender_type = db.Column(db.String(20))
+    message_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    unread_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # Set while the messages are in message_archive instead of the message table;
+    # restored_at counts as activity so a conversation just opened is not archived again
+    archived_at = db.Column(db.DateTime)
+    restored_at = db.Column(db.DateTime)
     
     # Relationship with messages
     messages = db.relationship('Message', backref='conversation', lazy='dynamic', 
                               order_by='Message.timestamp.asc()')
     
+    __table_args__ = (
+        # Conversation list: a user's pages ordered by (updated_at, id)
+        db.Index('ix_conversation_page_updated', 'fb_page_id', 'updated_at', 'id'),
+    )
+    
+    @staticmethod
+    def make_active_key(customer_id, fb_page_id):
+        return f"{customer_id}:{fb_page_id}"
+    
     def __repr__(self):
         return f'<Conversation {self.id}>'
         
@@ -75,8 +100,50 @@ class Message(db.Model):
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'))
     sender_type = db.Column(db.String(20))  # customer, agent
     sender_id = db.Column(db.String(64))   # fb_id for customer, user_id for agent
+    # Facebook message id of customer messages, so re-delivered webhooks are stored once
+    mid = db.Column(db.String(255), index=True, unique=True)
     message_text = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Position in the conversation (1, 2, ...), taken from Conversation.message_count
+    seq = db.Column(db.Integer)
+    # Delivery of agent replies: pending, sending, sent or failed
+    status = db.Column(db.String(20), default='sent', server_default='sent', nullable=False, index=True)
+    error = db.Column(db.Text)
+    # When a send worker claimed the reply, pushed back while it waits out a retry delay
+    claimed_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        # Message history and latest message per conversation ordered by (timestamp, id)
+        db.Index('ix_message_conversation_timestamp', 'conversation_id', 'timestamp', 'id'),
+        # Socket.IO catch-up: messages of a conversation after a sequence number
+        db.Index('ix_message_conversation_seq', 'conversation_id', 'seq', unique=True),
+    )
     
     def __repr__(self):
         return f'<Message {self.id}>'
+
+class MessageArchive(db.Model):
+    """Messages of a cold conversation, stored as one compressed JSON document"""
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), unique=True, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    raw_size = db.Column(db.Integer, nullable=False)
+    # The length makes MySQL use LONGBLOB rather than a 64 KB BLOB
+    data = db.Column(db.LargeBinary(length=2 ** 32 - 1), nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<MessageArchive {self.conversation_id}>'
+
+class WebhookEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(20), default='pending', index=True)  # pending, processing, failed
+    attempts = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    retry_at = db.Column(db.DateTime)  # a failed attempt is not retried before this
+    
+    def __repr__(self):
+        return f'<WebhookEvent {self.id} {self.status}>'
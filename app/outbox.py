@@ -0,0 +1,246 @@
+"""Outbound delivery of agent replies to the Messenger Send API.
+
+send_message stores the reply with status 'pending' and returns straight
+away. A pool of send workers delivers it to Graph and marks it 'sent' or
+'failed', telling the conversation room with a message_status Socket.IO
+event. The workers start with the first request or Socket.IO connection a
+server process handles; while idle they pick up replies left pending by a
+restart or another process and retry replies whose worker died.
+
+Workers share a FairScheduler keyed by the Facebook page id: pages take
+turns, each page sends within its own token bucket (OUTBOX_PAGE_RATE per
+second, bursts of OUTBOX_PAGE_BURST) and has one reply in flight at a
+time, so replies on a page sent through one process are delivered in the
+order they were written. Over budget, replies wait in the page's queue.
+A rate-limit error from Facebook pauses the page for the time it asks for
+and the reply is sent again without using up an attempt. Other transient
+failures (connection errors, 5xx responses) are retried with backoff
+before the message is given up as failed.
+"""
+import random
+import threading
+from datetime import datetime, timedelta
+import requests
+from flask import current_app
+from app import db, realtime, socketio, stats
+from app.cache import identity_cache
+from app.graph import graph, is_rate_limited, retry_after
+from app.log import get_logger
+from app.models import Message
+from app.ratelimit import FairScheduler, parse_rates
+from app.workers import WorkerPool, run_task
+
+log = get_logger('outbox')
+
+_scheduler = None
+_lock = threading.Lock()
+_counters = {'queued': 0, 'sent': 0, 'failed': 0, 'retries': 0, 'rate_limited': 0}
+
+class TransientSendError(Exception):
+    """A send failure worth retrying, after retry_after seconds if Facebook said so"""
+
+    def __init__(self, message, rate_limited=False, retry_after=None):
+        super().__init__(message)
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+
+def page_key(fb_page_id):
+    """The Facebook page id a page's budget is kept under"""
+    page = identity_cache.get_page(fb_page_id)
+    return page.page_id if page else str(fb_page_id)
+
+def enqueue(message_id, fb_page_id):
+    """Queue a pending message behind the other replies of its page"""
+    with _lock:
+        _counters['queued'] += 1
+
+    app = current_app._get_current_object()
+    if workers.enabled(app):
+        workers.start(app)
+        _scheduler.put(page_key(fb_page_id), (message_id, None))
+    else:
+        deliver(message_id)
+
+def _create_scheduler(app):
+    global _scheduler
+    _scheduler = FairScheduler(app.config['OUTBOX_PAGE_RATE'], app.config['OUTBOX_PAGE_BURST'],
+                               parse_rates(app.config['OUTBOX_PAGE_RATES']))
+
+def _worker(app, index):
+    """Deliver messages from the scheduler one at a time
+
+    Only the first worker polls the database, the others would find the same rows.
+    """
+    poll_interval = app.config['OUTBOX_POLL_INTERVAL']
+
+    with app.app_context():
+        while True:
+            task = _scheduler.get(timeout=poll_interval)
+            if task is None:
+                # Pick up messages left over from a restart or another process, or claimed by a dead worker
+                if index == 0:
+                    run_task(log, 'poll_error', _poll_pending, app)
+                continue
+
+            key, (message_id, attempt) = task
+            retry = run_task(log, 'delivery_error', _deliver_task, message_id, attempt, message_id=message_id)
+            if retry is None:
+                _scheduler.done(key)
+            else:
+                attempt, delay = retry
+                _scheduler.done(key, retry=(message_id, attempt), delay=delay)
+
+workers = WorkerPool(_worker, 'OUTBOX_WORKERS', setup=_create_scheduler)
+
+def _deliver_task(message_id, attempt):
+    """Send a scheduled message, returning (attempt, delay) when it should be tried again
+
+    attempt is None for a message that has not been claimed yet.
+    """
+    if attempt is None:
+        if not claim(message_id):
+            return None
+        attempt = 0
+    return attempt_delivery(message_id, attempt)
+
+def _poll_pending(app):
+    """Queue pending messages that no worker has picked up"""
+    release_stale(app.config['OUTBOX_STALE_AFTER'])
+    if _scheduler.depth():
+        return
+
+    rows = db.session.query(Message.id, Message.conversation_id).filter_by(status='pending') \
+        .order_by(Message.id).limit(100).all()
+    for message_id, conversation_id in rows:
+        conversation = identity_cache.get_conversation(conversation_id)
+        if conversation:
+            _scheduler.put(page_key(conversation.fb_page_id), (message_id, None))
+
+def release_stale(stale_after):
+    """Make messages claimed by a worker that died before sending them pending again"""
+    # A send takes seconds, so a reply claimed minutes ago and not due for a retry is stuck
+    stale_cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+    released = Message.query.filter(
+        Message.status == 'sending',
+        Message.claimed_at < stale_cutoff
+    ).update({'status': 'pending'}, synchronize_session=False)
+    db.session.commit()
+    if released:
+        log.warning('stale_messages_released', messages=released)
+    return released
+
+def claim(message_id):
+    """Mark a pending message as sending, False if another worker got it first"""
+    claimed = Message.query.filter_by(id=message_id, status='pending') \
+        .update({'status': 'sending', 'claimed_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return bool(claimed)
+
+def deliver(message_id):
+    """Claim a pending message and deliver it inline, waiting between retries"""
+    if not claim(message_id):
+        return
+
+    attempt = 0
+    while True:
+        retry = attempt_delivery(message_id, attempt)
+        if retry is None:
+            return
+        attempt, delay = retry
+        socketio.sleep(delay)
+
+def attempt_delivery(message_id, attempt):
+    """Try to send a claimed message once
+
+    Returns (attempt, delay) when the message should be sent again after
+    delay seconds, or None once it was sent or given up as failed.
+    """
+    message = db.session.get(Message, message_id)
+    max_attempts = current_app.config['OUTBOX_MAX_ATTEMPTS']
+    backoff = current_app.config['OUTBOX_RETRY_BACKOFF']
+    try:
+        send(message)
+        error = None
+    except TransientSendError as e:
+        if e.rate_limited:
+            # Over Facebook's budget the reply waits for the page instead of failing
+            with _lock:
+                _counters['rate_limited'] += 1
+            return hold(message_id, attempt, max(e.retry_after or 0, backoff))
+        error = str(e)
+        if attempt + 1 < max_attempts:
+            with _lock:
+                _counters['retries'] += 1
+            return hold(message_id, attempt + 1, random.uniform(0, backoff * 2 ** attempt))
+    except Exception as e:
+        error = str(e)
+
+    status = 'failed' if error else 'sent'
+    status_event = {
+        'id': message.id,
+        'conversation_id': message.conversation_id,
+        'seq': message.seq,
+        'status': status,
+        'error': error
+    }
+    Message.query.filter_by(id=message_id).update(
+        {'status': status, 'error': error}, synchronize_session=False)
+    db.session.commit()
+
+    with _lock:
+        _counters[status] += 1
+    realtime.publish('message_status', status_event,
+                     realtime.conversation_room(status_event['conversation_id']), key=message_id)
+    return None
+
+def hold(message_id, attempt, delay):
+    """Keep a claimed message from being released as stale while it waits to be sent again"""
+    Message.query.filter_by(id=message_id).update(
+        {'claimed_at': datetime.utcnow() + timedelta(seconds=delay)}, synchronize_session=False)
+    db.session.commit()
+    return attempt, delay
+
+def send(message):
+    """POST a message to the Send API, raising TransientSendError for retryable failures"""
+    conversation = identity_cache.get_conversation(message.conversation_id)
+    page = conversation and identity_cache.get_page(conversation.fb_page_id)
+    customer = conversation and identity_cache.get_customer(conversation.customer_id)
+    if not page or not customer:
+        raise ValueError('Page or customer not found')
+
+    payload = {
+        'recipient': {'id': customer.fb_id},
+        'message': {'text': message.message_text},
+        'messaging_type': 'RESPONSE'
+    }
+    try:
+        # Retries are left to the scheduler so a throttled page does not hold a worker
+        response = graph.post('me/messages', 'send_message', json=payload, max_retries=0,
+                              params={'access_token': page.access_token})
+    except requests.ConnectionError as e:
+        # Read timeouts are not retried, Facebook may already have delivered the message
+        raise TransientSendError(str(e)) from e
+
+    try:
+        response_data = response.json()
+    except ValueError:
+        response_data = {}
+    if response.status_code == 200 and not response_data.get('error'):
+        return
+    error = response_data.get('error', {}).get('message', f"HTTP {response.status_code}")
+    if is_rate_limited(response):
+        raise TransientSendError(error, rate_limited=True, retry_after=retry_after(response))
+    if response.status_code >= 500:
+        raise TransientSendError(error)
+    raise ValueError(error)
+
+def outbox_stats():
+    with _lock:
+        counters = dict(_counters, workers=workers.started)
+    if _scheduler is not None:
+        pages = _scheduler.stats()
+        counters['backlog'] = sum(page['depth'] for page in pages.values())
+        counters['pages'] = pages
+    return counters
+
+stats.register('outbox', outbox_stats)
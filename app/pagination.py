@@ -0,0 +1,62 @@
+"""Keyset (cursor) pagination helpers.
+
+Cursors are opaque URL-safe strings encoding a (timestamp, id) position.
+Pages are read with a range condition on an ordered (timestamp, id) pair,
+so the cost of a page does not depend on how deep into the history it is.
+"""
+import base64
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_, or_
+
+def encode_cursor(timestamp, id):
+    """Encode a (timestamp, id) position as an opaque cursor"""
+    raw = f"{timestamp.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor into (timestamp, id), raising ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def page_size(value):
+    """Clamp a requested page size to the configured bounds"""
+    default = current_app.config['API_PAGE_SIZE']
+    try:
+        size = int(value) if value else default
+    except ValueError:
+        size = default
+    return max(1, min(size, current_app.config['API_MAX_PAGE_SIZE']))
+
+def keyset_page(query, time_column, id_column, before=None, after=None, limit=50, newest_first=True):
+    """Return (rows, has_more) for one page of a query ordered by (time_column, id_column)
+
+    before returns rows older than the cursor and after returns rows newer
+    than it; with neither, the newest rows are returned. Rows always come
+    back in the requested display order. has_more tells whether further rows
+    exist in the direction that was paged.
+    """
+    if before:
+        timestamp, id = decode_cursor(before)
+        query = query.filter(or_(time_column < timestamp, and_(time_column == timestamp, id_column < id)))
+    if after:
+        timestamp, id = decode_cursor(after)
+        query = query.filter(or_(time_column > timestamp, and_(time_column == timestamp, id_column > id)))
+
+    # Walk away from the cursor, then flip into display order
+    if after:
+        query = query.order_by(time_column.asc(), id_column.asc())
+    else:
+        query = query.order_by(time_column.desc(), id_column.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if bool(after) == newest_first:
+        rows.reverse()
+    return rows, has_more
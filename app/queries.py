@@ -0,0 +1,17 @@
+"""Read queries shared by the dashboard and the JSON API"""
+from sqlalchemy.orm import contains_eager
+from app.models import Conversation
+
+def conversation_list_query(page_ids):
+    """Conversations of the given pages with their customer eager-loaded
+
+    The last message preview and unread count live on the conversation row,
+    so rendering the list needs no further queries.
+    """
+    return Conversation.query.join(
+        Conversation.customer
+    ).filter(
+        Conversation.fb_page_id.in_(page_ids)
+    ).options(
+        contains_eager(Conversation.customer)
+    )
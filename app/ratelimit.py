@@ -0,0 +1,160 @@
+"""Per-page send budgets and a fair scheduler over them.
+
+Facebook limits how fast each page may send. FairScheduler keeps a queue
+per page and a token bucket per page: workers take the next message from
+the pages in round-robin order, skipping pages that are out of tokens or
+paused after a rate-limit error, and wait when every page is throttled.
+A page has at most one message in flight, so its messages leave in order
+and a busy page cannot hold more than one worker.
+"""
+import threading
+import time
+from collections import deque
+
+class TokenBucket:
+    """Refills rate tokens per second up to burst; each send takes one
+
+    A rate of 0 or less leaves sends unlimited, except while paused.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available"""
+        self._refill(now)
+        paused = max(0.0, self.updated - now)
+        if self.rate <= 0:
+            return paused
+        return paused + max(0.0, 1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        if self.rate > 0:
+            self.tokens -= 1
+
+    def pause(self, seconds, now):
+        """Empty the bucket and stop refilling it for the given time"""
+        self._refill(now)
+        self.tokens = 0
+        self.updated = max(self.updated, now + seconds)
+
+class FairScheduler:
+    """Round-robin queues per key, each limited by its own token bucket"""
+
+    def __init__(self, rate, burst, rates=None):
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self._queues = {}
+        self._buckets = {}
+        self._ready = deque()
+        self._busy = set()
+        self._blocked_since = {}
+        self._stats = {}
+        self._cond = threading.Condition()
+
+    def put(self, key, item):
+        """Queue an item at the end of its key's queue"""
+        with self._cond:
+            queue = self._queues.setdefault(key, deque())
+            queue.append(item)
+            if len(queue) == 1 and key not in self._busy:
+                self._ready.append(key)
+            self._cond.notify()
+
+    def get(self, timeout):
+        """Take (key, item) from the next key with budget, or None after timeout"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = deadline - now
+                if wait <= 0:
+                    return None
+
+                for key in self._ready:
+                    bucket = self._bucket(key)
+                    delay = bucket.delay(now)
+                    if delay <= 0:
+                        break
+                    self._blocked_since.setdefault(key, now)
+                    wait = min(wait, delay)
+                else:
+                    self._cond.wait(wait)
+                    continue
+
+                self._ready.remove(key)
+                self._busy.add(key)
+                bucket.take(now)
+                stats = self._page_stats(key)
+                stats['dispatched'] += 1
+                blocked_since = self._blocked_since.pop(key, None)
+                if blocked_since is not None:
+                    stats['throttled_seconds'] += now - blocked_since
+                return key, self._queues[key].popleft()
+
+    def done(self, key, retry=None, delay=0):
+        """Finish the key's item in flight, putting retry back at the head of its queue
+
+        With a delay the key is paused for that long, for example when
+        Facebook answered with a rate-limit error.
+        """
+        with self._cond:
+            self._busy.discard(key)
+            queue = self._queues[key]
+            if retry is not None:
+                queue.appendleft(retry)
+            if delay > 0:
+                self._bucket(key).pause(delay, time.monotonic())
+                self._page_stats(key)['paused'] += 1
+            if queue:
+                self._ready.append(key)
+            else:
+                del self._queues[key]
+            self._cond.notify_all()
+
+    def depth(self):
+        with self._cond:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rates.get(key, self.rate), self.burst)
+        return bucket
+
+    def _page_stats(self, key):
+        return self._stats.setdefault(key, {'dispatched': 0, 'paused': 0, 'throttled_seconds': 0.0})
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            pages = {}
+            for key in set(self._queues) | set(self._stats):
+                stats = self._page_stats(key)
+                throttled = stats['throttled_seconds']
+                if key in self._blocked_since:
+                    throttled += now - self._blocked_since[key]
+                pages[key] = dict(stats,
+                                  throttled_seconds=round(throttled, 3),
+                                  depth=len(self._queues.get(key, ())),
+                                  in_flight=key in self._busy)
+            return pages
+
+def parse_rates(value):
+    """Per-key rates from 'key:rate,key:rate'"""
+    rates = {}
+    for entry in (value or '').split(','):
+        key, _, rate = entry.strip().rpartition(':')
+        if key:
+            rates[key] = float(rate)
+    return rates
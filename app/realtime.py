@@ -0,0 +1,93 @@
+"""Socket.IO fan-out to tenant rooms.
+
+Agents' sockets join a room per Facebook page they own when they connect,
+and a room per conversation they open. Updates are emitted to the rooms of
+the pages or conversation they concern instead of being broadcast to every
+connected agent. Per-event counters record how many emits were made and
+how many sockets of this process they reached.
+
+During bursts, publish() holds events per room for REALTIME_BATCH_WINDOW_MS
+and sends them as one batch frame. Events published with the same key (for
+example repeated conversation_updates of one conversation) are merged so
+only the latest is sent.
+"""
+import threading
+from collections import OrderedDict
+from flask import current_app
+from app import socketio, stats
+
+_counters = {}
+_batching = {'published': 0, 'merged': 0, 'frames': 0}
+_buffers = {}
+_lock = threading.Lock()
+
+def page_room(fb_page_id):
+    return f"page_{fb_page_id}"
+
+def conversation_room(conversation_id):
+    return f"conversation_{conversation_id}"
+
+def emit(event, data, rooms):
+    """Emit an event to the given rooms, each socket receiving it once"""
+    rooms = list(rooms)
+    if not rooms:
+        return
+
+    # Only sockets connected to this process are visible here
+    recipients = sum(1 for _ in socketio.server.manager.get_participants('/', rooms))
+    socketio.emit(event, data, to=rooms)
+
+    with _lock:
+        counters = _counters.setdefault(event, {'emits': 0, 'rooms': 0, 'recipients': 0})
+        counters['emits'] += 1
+        counters['rooms'] += len(rooms)
+        counters['recipients'] += recipients
+
+def publish(event, data, room, key=None):
+    """Queue an event for a room, replacing a queued event with the same key
+
+    The room's events are sent together once the batch window has passed.
+    With a window of 0 the event is emitted straight away.
+    """
+    window = current_app.config['REALTIME_BATCH_WINDOW_MS'] / 1000
+    if window <= 0:
+        emit(event, data, [room])
+        return
+
+    key = (event, key) if key is not None else object()
+    with _lock:
+        _batching['published'] += 1
+        buffer = _buffers.get(room)
+        if buffer is None:
+            buffer = _buffers[room] = OrderedDict()
+            socketio.start_background_task(_flush_later, room, window)
+        elif key in buffer:
+            # Move the merged event to the end so the batch keeps the order of the latest updates
+            del buffer[key]
+            _batching['merged'] += 1
+        buffer[key] = (event, data)
+
+def _flush_later(room, window):
+    socketio.sleep(window)
+    with _lock:
+        events = list(_buffers.pop(room, {}).values())
+        _batching['frames'] += 1
+
+    if len(events) == 1:
+        emit(*events[0], [room])
+    elif events:
+        emit('batch', {'events': [[event, data] for event, data in events]}, [room])
+
+def realtime_stats():
+    with _lock:
+        return {
+            event: dict(counters, recipients_per_emit=round(counters['recipients'] / counters['emits'], 2))
+            for event, counters in _counters.items()
+        }
+
+def batching_stats():
+    with _lock:
+        return dict(_batching, pending_rooms=len(_buffers))
+
+stats.register('socketio', realtime_stats)
+stats.register('socketio_batching', batching_stats)
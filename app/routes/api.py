@@ -1,11 +1,24 @@
 from flask import Blueprint, request, jsonify, current_app
-from app import db, socketio
-from app.models import FacebookPage, Customer, Conversation, Message
+from flask_login import login_required, current_user
+from app import db, archive, ingest, enrich, outbox, realtime, search, stats
+from app.cache import identity_cache
+from app.dedupe import message_dedupe
+from app.fragments import fragment_cache, list_etag
+from app.log import get_logger, Payload
+from app.metrics import WEBHOOK_EVENTS, WEBHOOK_STAGE_SECONDS
+from app.pagination import encode_cursor, keyset_page, page_size
+from app.queries import conversation_list_query
+from app.serializers import CONVERSATION_DETAIL, CONVERSATION_LIST_ITEM, CUSTOMER, CUSTOMER_DETAIL, DAY_TIME, \
+    MESSAGE, preview
+from app.signature import read_verified_body, WebhookRejected
+from app.upsert import insert_or_ignore
+from app.models import Customer, Conversation, Message
 from datetime import datetime, timedelta
-import requests
 import json
 
 api = Blueprint('api', __name__, url_prefix='/api')
+webhook_log = get_logger('webhook')
+ingest_log = get_logger('ingest')
 
 @api.route('/webhook', methods=['GET', 'POST'])
 def webhook():
@@ -18,145 +31,323 @@ def webhook():
         
         if mode and token:
             if mode == 'subscribe' and token == verify_token:
-                print("WEBHOOK_VERIFIED")
+                webhook_log.info('webhook_verified')
                 return challenge, 200
         
         return "Verification failed", 403
     
     elif request.method == 'POST':
+        # Check the signature on the raw bytes before spending anything on parsing
+        try:
+            body = read_verified_body(request, current_app.config['FB_APP_SECRET'],
+                                      current_app.config['WEBHOOK_MAX_BODY_BYTES'],
+                                      current_app.config['WEBHOOK_REQUIRE_SIGNATURE'])
+        except WebhookRejected as e:
+            webhook_log.info('webhook_rejected', reason=e.reason, content_length=request.content_length)
+            return "Webhook rejected", e.status
+        
         # Handle incoming webhook events
         try:
-            data = request.json
-            print(f"Webhook received: {json.dumps(data)}")
+            payload = body.decode()
+            data = json.loads(payload)
+            webhook_log.info('webhook_received', bytes=len(body), entries=len(data.get('entry') or []))
+            webhook_log.debug('webhook_payload', payload=Payload(data))
             
-            # Ensure this is a page webhook event
+            # Ensure this is a page webhook event, then queue it for the workers
             if data.get('object') == 'page':
-                for entry in data.get('entry', []):
-                    page_id = entry.get('id')
-                    messaging_events = entry.get('messaging', [])
-                    
-                    # Process each messaging event
-                    for event in messaging_events:
-                        process_messaging_event(event, page_id)
+                ingest.enqueue(payload)
             
             return "EVENT_RECEIVED", 200
         except Exception as e:
-            print(f"Webhook error: {str(e)}")
+            webhook_log.error('webhook_error', error=str(e))
             return "Error processing webhook", 500
 
+def process_webhook_payload(data):
+    """Process every messaging event in a page webhook payload"""
+    events = []
+    for entry in data.get('entry') or []:
+        if not isinstance(entry, dict):
+            ingest_log.warning('entry_invalid', entry=Payload(entry))
+            continue
+        page_id = entry.get('id')
+        for event in entry.get('messaging') or []:
+            events.append((page_id, event))
+    
+    process_messaging_events(events)
+
 def process_messaging_event(event, fb_page_id):
     """Process a Facebook Messenger event and store in database"""
-    sender_id = event.get('sender', {}).get('id')
-    recipient_id = event.get('recipient', {}).get('id')
+    process_messaging_events([(fb_page_id, event)])
+
+def invalid_event_reason(page_id, event):
+    """Why a messaging event cannot be stored, or None when it is well-formed"""
+    if not isinstance(page_id, str) or not page_id:
+        return 'page_id'
+    if not isinstance(event, dict):
+        return 'event'
+    sender = event.get('sender')
+    if not isinstance(sender, dict) or not isinstance(sender.get('id'), str) or not sender['id']:
+        return 'sender'
+    if not isinstance(event.get('recipient', {}), dict):
+        return 'recipient'
     timestamp = event.get('timestamp')
-    message_data = event.get('message', {})
+    if timestamp is not None and (isinstance(timestamp, bool) or not isinstance(timestamp, (int, float))):
+        return 'timestamp'
+    message_data = event.get('message')
+    if message_data is not None:
+        if not isinstance(message_data, dict):
+            return 'message'
+        if not isinstance(message_data.get('text', ''), str):
+            return 'text'
+        if not isinstance(message_data.get('mid', ''), str):
+            return 'mid'
+    return None
+
+def process_messaging_events(events):
+    """Store a batch of (page_id, event) pairs in a single transaction
+    
+    Pages, customers and conversations for the whole batch are resolved with
+    set-based queries, so the number of database round-trips does not grow
+    with the number of events. Malformed events are logged and skipped so
+    they cannot fail the rest of the batch.
+    """
+    valid = []
+    for page_id, event in events:
+        reason = invalid_event_reason(page_id, event)
+        if reason is None:
+            valid.append((page_id, event))
+        else:
+            WEBHOOK_EVENTS.inc(result='invalid')
+            ingest_log.warning('event_invalid', page_id=page_id, reason=reason, payload=Payload(event))
     
     # Ignore messages sent by the page itself
-    if sender_id == recipient_id:
+    events = [
+        (page_id, event) for page_id, event in valid
+        if event['sender']['id'] != event.get('recipient', {}).get('id')
+    ]
+    if not events:
         return
     
+    mids = []
     try:
-        # Get the page from our database
-        page = FacebookPage.query.filter_by(page_id=fb_page_id).first()
-        if not page:
-            print(f"Page not found in database: {fb_page_id}")
+        # Get all pages referenced by the batch from the cache or our database
+        with WEBHOOK_STAGE_SECONDS.time(stage='page_lookup'):
+            page_ids = {page_id for page_id, _ in events}
+            pages = identity_cache.get_pages_by_page_id(page_ids)
+        for page_id in page_ids - pages.keys():
+            ingest_log.warning('page_not_found', page_id=page_id)
+        events = [(pages[page_id], event) for page_id, event in events if page_id in pages]
+        if not events:
             return
         
-        # Get or create customer
-        customer = Customer.query.filter_by(fb_id=sender_id).first()
-        if not customer:
-            # Fetch customer info from Facebook
-            user_url = f"https://graph.facebook.com/{sender_id}"
-            params = {
-                'fields': 'name,profile_pic',
-                'access_token': page.access_token
-            }
-            response = requests.get(user_url, params=params)
-            user_data = response.json()
-            
-            customer = Customer(
-                fb_id=sender_id,
-                name=user_data.get('name', 'Unknown User'),
-                profile_pic=user_data.get('profile_pic', '')
-            )
-            db.session.add(customer)
-            db.session.commit()
+        # Drop messages Facebook delivered again before doing any work for them. Only messages
+        # of known pages are claimed, so a re-delivery after the page is connected is stored
+        received = len(events)
+        with WEBHOOK_STAGE_SECONDS.time(stage='dedupe'):
+            events, mids = message_dedupe.claim(events)
+        WEBHOOK_EVENTS.inc(received - len(events), result='duplicate')
+        if not events:
+            return
+        
+        # Get existing customers and create the missing ones
+        with WEBHOOK_STAGE_SECONDS.time(stage='customer_lookup'):
+            sender_pages = {}
+            for page, event in events:
+                sender_pages.setdefault(event['sender']['id'], page)
+            customers = identity_cache.get_customers_by_fb_id(sender_pages.keys())
+            customers.update(create_customers(sender_pages.keys() - customers.keys()))
         
-        # Find existing conversation or create new one
-        conversation = find_or_create_conversation(customer.id, page.id)
+        # Find existing conversations or create new ones
+        with WEBHOOK_STAGE_SECONDS.time(stage='conversation_resolve'):
+            pairs = {(customers[event['sender']['id']].id, page.id) for page, event in events}
+            conversations = find_or_create_conversations(pairs)
         
-        # Store the message
-        if message_data and message_data.get('text'):
+        # Store the messages
+        new_messages = []
+        for page, event in events:
+            message_data = event.get('message', {})
+            if not (message_data and message_data.get('text')):
+                continue
+            
+            customer = customers[event['sender']['id']]
+            conversation = conversations[(customer.id, page.id)]
+            timestamp = event.get('timestamp')
             message = Message(
                 conversation_id=conversation.id,
                 sender_type='customer',
-                sender_id=sender_id,
+                sender_id=customer.fb_id,
+                mid=message_data.get('mid'),
                 message_text=message_data.get('text'),
                 timestamp=datetime.fromtimestamp(timestamp / 1000) if timestamp else datetime.utcnow()
             )
-            db.session.add(message)
-            
-            # Update conversation timestamp
-            conversation.updated_at = datetime.utcnow()
+            new_messages.append((message, conversation, customer))
+        
+        if not new_messages:
             db.session.commit()
+            WEBHOOK_EVENTS.inc(len(events), result='processed')
+            request_profiles(customers, sender_pages)
+            return
+        
+        # Update conversation timestamps and summaries, numbering the new messages
+        with WEBHOOK_STAGE_SECONDS.time(stage='store'):
+            now = datetime.utcnow()
+            touched, page_ids = {}, {}
+            for message, conversation, _ in new_messages:
+                touched.setdefault(conversation.id, []).append(message)
+                page_ids[conversation.id] = conversation.fb_page_id
+            unread_counts = update_summaries(touched, now, unread=True)
             
-            # Emit Socket.IO event with the new message
-            message_data = {
-                'id': message.id,
-                'conversation_id': conversation.id,
-                'sender_type': message.sender_type,
-                'sender_id': message.sender_id,
-                'message_text': message.message_text,
-                'timestamp': message.timestamp.strftime('%H:%M'),
-                'customer': {
-                    'id': customer.id,
-                    'name': customer.name,
-                    'profile_pic': customer.profile_pic
-                }
-            }
-            socketio.emit('new_message', message_data, room=f"conversation_{conversation.id}")
-            # Also emit to the general room for conversation list updates
-            socketio.emit('conversation_update', {
-                'conversation_id': conversation.id,
-                'last_message': message.message_text[:30] + ('...' if len(message.message_text) > 30 else ''),
-                'updated_at': conversation.updated_at.strftime('%b %d, %H:%M')
-            })
+            db.session.add_all([message for message, _, _ in new_messages])
+            db.session.flush()
+            search.index_messages([message for message, _, _ in new_messages])
+        
+        # Build the Socket.IO payloads before the commit expires the instances
+        message_events = [MESSAGE(message, customer=CUSTOMER(customer)) for message, _, customer in new_messages]
+        conversation_events = [(page_ids[conversation_id], {
+            'conversation_id': conversation_id,
+            'last_message': preview(messages[-1].message_text),
+            'last_sender_type': messages[-1].sender_type,
+            'unread_count': unread_counts[conversation_id],
+            'updated_at': DAY_TIME(now)
+        }) for conversation_id, messages in touched.items()]
+        
+        with WEBHOOK_STAGE_SECONDS.time(stage='commit'):
+            db.session.commit()
     
     except Exception as e:
         db.session.rollback()
-        print(f"Error processing message: {str(e)}")
+        # A re-delivery must not be dropped as a duplicate of a message that was never stored
+        message_dedupe.release(mids)
+        WEBHOOK_EVENTS.inc(len(events), result='failed')
+        ingest_log.error('process_failed', events=len(events), error=str(e))
+        raise
+    
+    WEBHOOK_EVENTS.inc(len(events), result='processed')
+    fragment_cache.invalidate(touched.keys())
+    request_profiles(customers, sender_pages)
+    
+    with WEBHOOK_STAGE_SECONDS.time(stage='emit'):
+        # Emit Socket.IO events with the new messages
+        for message_event in message_events:
+            realtime.publish('new_message', message_event,
+                             realtime.conversation_room(message_event['conversation_id']))
+        
+        # Also tell the agents of each page once per touched conversation
+        for fb_page_id, conversation_event in conversation_events:
+            realtime.publish('conversation_update', conversation_event, realtime.page_room(fb_page_id),
+                             key=conversation_event['conversation_id'])
+
+def conversation_summary(messages, now, unread):
+    """Column values bringing a conversation's summary up to date with new messages
+    
+    Counters are incremented in SQL so concurrent writers do not lose updates.
+    Customer messages add to unread_count, an agent reply clears it.
+    """
+    latest = messages[-1]
+    return {
+        'updated_at': now,
+        'last_message_text': latest.message_text[:255],
+        'last_message_at': latest.timestamp,
+        'last_sender_type': latest.sender_type,
+        'message_count': Conversation.message_count + len(messages),
+        'unread_count': Conversation.unread_count + len(messages) if unread else 0
+    }
+
+def update_summaries(touched, now, unread):
+    """Bring the summaries of {conversation_id: [new messages]} up to date and number the messages
+    
+    message_count doubles as the conversation's message sequence: it is
+    incremented in SQL, which on server databases also locks the row until
+    commit, and the new messages take the numbers just reserved. Returns
+    {conversation_id: unread_count}.
+    """
+    for conversation_id, messages in touched.items():
+        Conversation.query.filter_by(id=conversation_id).update(
+            conversation_summary(messages, now, unread), synchronize_session=False)
+    
+    unread_counts = {}
+    for conversation_id, message_count, unread_count in db.session.query(
+            Conversation.id, Conversation.message_count, Conversation.unread_count
+    ).filter(Conversation.id.in_(touched.keys())):
+        messages = touched[conversation_id]
+        for seq, message in enumerate(messages, start=message_count - len(messages) + 1):
+            message.seq = seq
+        unread_counts[conversation_id] = unread_count
+    return unread_counts
+
+def request_profiles(customers, sender_pages):
+    """Queue profile fetches for customers that still have a placeholder profile"""
+    for sender_id, customer in customers.items():
+        if enrich.needs_profile(customer):
+            enrich.request_profile(customer, sender_pages[sender_id].access_token)
 
-def find_or_create_conversation(customer_id, fb_page_id):
-    """Find existing conversation or create a new one"""
-    # Check for existing conversation in last 24 hours
+def create_customers(fb_ids):
+    """Create customers for new senders, returning {fb_id: CustomerRef}
+    
+    Another worker may be creating the same customer concurrently, so rows
+    are inserted with the unique fb_id constraint deciding the winner and
+    read back afterwards. The profile is fetched in the background once the
+    messages are stored.
+    """
+    if not fb_ids:
+        return {}
+    
+    insert_or_ignore(Customer, [
+        {'fb_id': fb_id, 'name': enrich.PLACEHOLDER_NAME, 'profile_pic': ''}
+        for fb_id in fb_ids
+    ], 'fb_id')
+    customers = Customer.query.filter(Customer.fb_id.in_(fb_ids)).all()
+    return {customer.fb_id: identity_cache.customer_ref(customer) for customer in customers}
+
+def find_or_create_conversations(pairs):
+    """Find or create conversations for a set of (customer_id, fb_page_id) pairs
+    
+    The conversation new messages go to holds the pair's unique active_key.
+    Once it has been idle for 24 hours the key is released and a new
+    conversation takes it over. Creation goes through the unique constraint,
+    so concurrent workers agree on a single conversation. New conversations
+    are not committed, so they share the caller's transaction.
+    """
     cutoff_time = datetime.utcnow() - timedelta(hours=24)
+    keys = {Conversation.make_active_key(*pair): pair for pair in pairs}
     
-    conversation = Conversation.query.filter_by(
-        customer_id=customer_id, 
-        fb_page_id=fb_page_id
-    ).filter(
-        Conversation.updated_at >= cutoff_time
-    ).order_by(
-        Conversation.updated_at.desc()
-    ).first()
+    def load(active_keys):
+        # Lock the rows on server databases so a concurrent release waits for us
+        return Conversation.query.filter(
+            Conversation.active_key.in_(active_keys)
+        ).with_for_update().all()
     
-    if conversation:
-        return conversation
+    conversations = {}
+    expired = []
+    for conversation in load(keys):
+        if conversation.updated_at >= cutoff_time:
+            conversations[keys[conversation.active_key]] = conversation
+        else:
+            expired.append(conversation.id)
     
-    # Create new conversation
-    conversation = Conversation(
-        fb_page_id=fb_page_id,
-        customer_id=customer_id,
-        status='open'
-    )
-    db.session.add(conversation)
-    db.session.commit()
+    # Release the keys of conversations that fell out of the 24h window
+    if expired:
+        Conversation.query.filter(
+            Conversation.id.in_(expired),
+            Conversation.updated_at < cutoff_time
+        ).update({'active_key': None, 'updated_at': Conversation.updated_at}, synchronize_session=False)
     
-    return conversation
+    # Create new conversations
+    missing = [key for key, pair in keys.items() if pair not in conversations]
+    if missing:
+        insert_or_ignore(Conversation, [
+            {'customer_id': keys[key][0], 'fb_page_id': keys[key][1], 'status': 'open', 'active_key': key}
+            for key in missing
+        ], 'active_key')
+        for conversation in load(missing):
+            conversations[keys[conversation.active_key]] = conversation
+    
+    return conversations
+
 
 @api.route('/send-message', methods=['POST'])
 def send_message():
-    """Send a message to a Facebook user"""
+    """Store a reply to a Facebook user and queue it for delivery"""
     data = request.json
     conversation_id = data.get('conversation_id')
     message_text = data.get('message')
@@ -167,83 +358,168 @@ def send_message():
     
     try:
         # Get conversation and related data
-        conversation = Conversation.query.get(conversation_id)
+        conversation = identity_cache.get_conversation(int(conversation_id))
         if not conversation:
             return jsonify({'error': 'Conversation not found'}), 404
         
-        page = FacebookPage.query.get(conversation.fb_page_id)
-        customer = Customer.query.get(conversation.customer_id)
+        page = identity_cache.get_page(conversation.fb_page_id)
+        customer = identity_cache.get_customer(conversation.customer_id)
         
         if not page or not customer:
             return jsonify({'error': 'Page or customer not found'}), 404
         
-        # Send message to Facebook
-        url = f"https://graph.facebook.com/v18.0/me/messages"
-        payload = {
-            'recipient': {'id': customer.fb_id},
-            'message': {'text': message_text},
-            'messaging_type': 'RESPONSE'
-        }
-        params = {'access_token': page.access_token}
-        
-        response = requests.post(url, json=payload, params=params)
-        response_data = response.json()
-        
-        if response.status_code != 200 or response_data.get('error'):
-            return jsonify({'error': 'Failed to send message to Facebook', 'details': response_data}), 400
-        
-        # Store message in our database
+        # Store the message, the send workers deliver it to Facebook
+        updated_at = datetime.utcnow()
         message = Message(
             conversation_id=conversation.id,
             sender_type='agent',
             sender_id=user_id,
-            message_text=message_text
+            message_text=message_text,
+            timestamp=updated_at,
+            status='pending'
         )
+        
+        # Update conversation timestamp and summary, the reply marks it as read
+        update_summaries({conversation.id: [message]}, updated_at, unread=False)
         db.session.add(message)
+        db.session.flush()
+        search.index_messages([message])
         
-        # Update conversation timestamp
-        conversation.updated_at = datetime.utcnow()
+        message_event = MESSAGE(message)
+        message_time = message_event['timestamp']
         db.session.commit()
+        fragment_cache.invalidate([conversation.id])
         
         # Emit Socket.IO event with the new message
-        message_time = message.timestamp.strftime('%H:%M')
-        socketio.emit('new_message', {
-            'id': message.id,
-            'conversation_id': conversation.id,
-            'sender_type': 'agent',
-            'sender_id': user_id,
-            'message_text': message_text,
-            'timestamp': message_time
-        }, room=f"conversation_{conversation.id}")
+        realtime.publish('new_message', message_event, realtime.conversation_room(conversation.id))
         
-        # Also emit to the general room for conversation list updates
-        socketio.emit('conversation_update', {
+        # Also update the conversation list of the page's agents
+        realtime.publish('conversation_update', {
             'conversation_id': conversation.id,
-            'last_message': message_text[:30] + ('...' if len(message_text) > 30 else ''),
-            'updated_at': conversation.updated_at.strftime('%b %d, %H:%M')
-        })
+            'last_message': preview(message_text),
+            'last_sender_type': 'agent',
+            'unread_count': 0,
+            'updated_at': DAY_TIME(updated_at)
+        }, realtime.page_room(conversation.fb_page_id), key=conversation.id)
+        
+        outbox.enqueue(message_event['id'], conversation.fb_page_id)
         
         return jsonify({
             'success': True, 
-            'message': 'Message sent successfully',
+            'message': 'Message queued for delivery',
+            'message_id': message_event['id'],
+            'status': 'pending',
             'message_time': message_time
-        }), 200
+        }), 202
     
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@api.route('/conversations', methods=['GET'])
+@login_required
+def list_conversations():
+    """List the current user's conversations, newest first, one page at a time"""
+    page_ids = [page.id for page in current_user.fb_pages]
+    
+    try:
+        conversations, has_more = keyset_page(
+            conversation_list_query(page_ids),
+            Conversation.updated_at, Conversation.id,
+            before=request.args.get('before'),
+            after=request.args.get('after'),
+            limit=page_size(request.args.get('limit'))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # A client that already has this page of the list gets an empty 304
+    etag = list_etag(conversations, has_more)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(conversation_list_data(conversations, has_more))
+    response.set_etag(etag)
+    # Browsers revalidate every time instead of reusing a stale list
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def conversation_list_data(conversations, has_more):
+    """The JSON body of a page of the conversation list"""
+    return {
+        'success': True,
+        'conversations': CONVERSATION_LIST_ITEM.many(conversations),
+        'has_more': has_more,
+        'cursors': {
+            'before': encode_cursor(conversations[-1].updated_at, conversations[-1].id) if conversations else None,
+            'after': encode_cursor(conversations[0].updated_at, conversations[0].id) if conversations else None
+        }
+    }
+
+@api.route('/search', methods=['GET'])
+@login_required
+def search_messages():
+    """Search the messages of the current user's pages, best match first"""
+    terms = search.parse_terms(request.args.get('q', ''), current_app.config['SEARCH_MAX_TERMS'])
+    if not terms:
+        return jsonify({'error': 'Missing search query'}), 400
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'error': 'Invalid offset'}), 400
+    
+    limit = page_size(request.args.get('limit'))
+    page_ids = [page.id for page in current_user.fb_pages]
+    results, has_more = search.search_messages(page_ids, terms, limit, offset,
+                                               current_app.config['SEARCH_SNIPPET_WORDS'])
+    
+    return jsonify({
+        'success': True,
+        'results': results,
+        'has_more': has_more,
+        'next_offset': offset + len(results) if has_more else None
+    }), 200
+
 @api.route('/conversation/<int:conversation_id>', methods=['GET'])
+@login_required
 def get_conversation(conversation_id):
     """Get conversation data including messages"""
+    page_ids = [page.id for page in current_user.fb_pages]
+    
     try:
-        # Get conversation and check if it exists
-        conversation = Conversation.query.get(conversation_id)
+        # Get conversation and check it exists on one of the current user's pages
+        conversation = Conversation.query.filter(
+            Conversation.id == conversation_id,
+            Conversation.fb_page_id.in_(page_ids)
+        ).first()
         if not conversation:
             return jsonify({'error': 'Conversation not found'}), 404
         
-        # Get all messages for the conversation
-        messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.timestamp).all()
+        # Bring back the messages of a conversation that went to the archive
+        if conversation.archived_at:
+            archive.restore(conversation.id)
+        
+        # Get one page of messages, the latest ones unless a cursor is given
+        try:
+            messages, has_more = keyset_page(
+                Message.query.filter_by(conversation_id=conversation_id),
+                Message.timestamp, Message.id,
+                before=request.args.get('before'),
+                after=request.args.get('after'),
+                limit=page_size(request.args.get('limit')),
+                newest_first=False
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Opening the latest messages marks the conversation as read
+        if conversation.unread_count and not (request.args.get('before') or request.args.get('after')):
+            # updated_at is kept as is so reading does not reorder the conversation list
+            Conversation.query.filter_by(id=conversation.id).update(
+                {'unread_count': 0, 'updated_at': Conversation.updated_at}, synchronize_session=False)
+            db.session.commit()
+            fragment_cache.invalidate([conversation.id])
         
         # Get customer data
         customer = Customer.query.get(conversation.customer_id)
@@ -251,39 +527,23 @@ def get_conversation(conversation_id):
             return jsonify({'error': 'Customer not found'}), 404
         
         # Format message data
-        message_data = []
-        for message in messages:
-            message_data.append({
-                'id': message.id,
-                'sender_type': message.sender_type,
-                'sender_id': message.sender_id,
-                'message_text': message.message_text,
-                'timestamp': message.timestamp.strftime('%H:%M')
-            })
-        
-        # Format customer data
-        customer_data = {
-            'id': customer.id,
-            'fb_id': customer.fb_id,
-            'name': customer.name,
-            'profile_pic': customer.profile_pic,
-            'created_at': customer.created_at.strftime('%B %d, %Y')
-        }
-        
-        # Format conversation data
-        conversation_data = {
-            'id': conversation.id,
-            'status': conversation.status,
-            'created_at': conversation.created_at.strftime('%B %d, %Y %H:%M'),
-            'updated_at': conversation.updated_at.strftime('%B %d, %Y %H:%M')
-        }
-        
         return jsonify({
             'success': True,
-            'conversation': conversation_data,
-            'customer': customer_data,
-            'messages': message_data
+            'conversation': CONVERSATION_DETAIL(conversation),
+            'customer': CUSTOMER_DETAIL(customer),
+            'messages': MESSAGE.many(messages),
+            'has_more': has_more,
+            'cursors': {
+                'before': encode_cursor(messages[0].timestamp, messages[0].id) if messages else None,
+                'after': encode_cursor(messages[-1].timestamp, messages[-1].id) if messages else None
+            }
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@api.route('/stats', methods=['GET'])
+@login_required
+def get_stats():
+    """Runtime statistics such as webhook queue depth and lag"""
+    return jsonify(stats.snapshot()), 200
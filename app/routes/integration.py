@@ -1,8 +1,10 @@
 from flask import Blueprint, render_template, redirect, url_for, current_app, request, flash, session, jsonify
 from flask_login import login_required, current_user
-import requests
-from app import db
+from app import db, socketio
 from app.models import FacebookPage
+from app.cache import identity_cache
+from app.graph import graph
+from app.realtime import page_room
 import json
 import os
 
@@ -44,10 +46,13 @@ def callback():
     fb_app_secret = current_app.config['FB_APP_SECRET']
     redirect_uri = current_app.config['FB_REDIRECT_URI']
     
-    token_url = f"https://graph.facebook.com/v18.0/oauth/access_token?client_id={fb_app_id}&redirect_uri={redirect_uri}&client_secret={fb_app_secret}&code={code}"
-    
     try:
-        response = requests.get(token_url)
+        response = graph.get('oauth/access_token', 'oauth_token', params={
+            'client_id': fb_app_id,
+            'redirect_uri': redirect_uri,
+            'client_secret': fb_app_secret,
+            'code': code
+        })
         token_data = response.json()
         access_token = token_data.get('access_token')
         
@@ -56,8 +61,12 @@ def callback():
             return redirect(url_for('integration.manage'))
         
         # Get long-lived access token
-        long_lived_token_url = f"https://graph.facebook.com/v18.0/oauth/access_token?grant_type=fb_exchange_token&client_id={fb_app_id}&client_secret={fb_app_secret}&fb_exchange_token={access_token}"
-        response = requests.get(long_lived_token_url)
+        response = graph.get('oauth/access_token', 'oauth_token', params={
+            'grant_type': 'fb_exchange_token',
+            'client_id': fb_app_id,
+            'client_secret': fb_app_secret,
+            'fb_exchange_token': access_token
+        })
         long_lived_token_data = response.json()
         long_lived_access_token = long_lived_token_data.get('access_token')
         
@@ -66,8 +75,7 @@ def callback():
             return redirect(url_for('integration.manage'))
         
         # Get user's Facebook pages
-        pages_url = "https://graph.facebook.com/v18.0/me/accounts"
-        response = requests.get(pages_url, params={'access_token': long_lived_access_token})
+        response = graph.get('me/accounts', 'accounts', params={'access_token': long_lived_access_token})
         pages_data = response.json().get('data', [])
         
         if not pages_data:
@@ -75,6 +83,7 @@ def callback():
             return redirect(url_for('integration.manage'))
         
         # Save pages to database
+        saved_pages = []
         for page in pages_data:
             page_id = page.get('id')
             page_name = page.get('name')
@@ -89,6 +98,7 @@ def callback():
                 existing_page.access_token = page_access_token
                 existing_page.is_active = True
                 existing_page.user_id = current_user.id
+                saved_pages.append(existing_page)
             else:
                 # Create new page
                 new_page = FacebookPage(page_id=page_id, page_name=page_name, 
@@ -96,14 +106,19 @@ def callback():
                 db.session.add(new_page)
             
             # Subscribe to page webhooks
-            subscribe_url = f"https://graph.facebook.com/v18.0/{page_id}/subscribed_apps"
             subscribe_data = {
                 'access_token': page_access_token,
                 'subscribed_fields': 'messages,messaging_postbacks,messaging_optins'
             }
-            requests.post(subscribe_url, data=subscribe_data)
+            graph.post(f"{page_id}/subscribed_apps", 'subscribed_apps',
+                       data=subscribe_data, idempotent=True)
         
         db.session.commit()
+        
+        # Drop cached snapshots carrying the old tokens and owners
+        for saved_page in saved_pages:
+            identity_cache.invalidate_page(saved_page)
+        
         flash("Facebook pages connected successfully!")
         return redirect(url_for('integration.manage'))
     
@@ -123,12 +138,16 @@ def disconnect(page_id):
     
     try:
         # Unsubscribe from webhooks
-        unsubscribe_url = f"https://graph.facebook.com/v18.0/{page.page_id}/subscribed_apps"
-        requests.delete(unsubscribe_url, params={'access_token': page.access_token})
+        graph.delete(f"{page.page_id}/subscribed_apps", 'subscribed_apps',
+                     params={'access_token': page.access_token})
         
         # Mark page as inactive or delete
         db.session.delete(page)
         db.session.commit()
+        identity_cache.invalidate_page(page)
+        
+        # Stop pushing the page's updates to connected agents
+        socketio.close_room(page_room(page.id))
         
         flash("Facebook page disconnected successfully")
     except Exception as e:
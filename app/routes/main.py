@@ -1,6 +1,10 @@
 from flask import Blueprint, render_template, redirect, url_for
 from flask_login import login_required, current_user
+from app import archive
 from app.models import FacebookPage, Conversation, Message
+from app.fragments import fragment_cache, render_item
+from app.pagination import encode_cursor, keyset_page, page_size
+from app.queries import conversation_list_query
 
 main = Blueprint('main', __name__)
 
@@ -20,14 +24,34 @@ def dashboard():
     if not pages:
         return redirect(url_for('integration.manage'))
     
-    # Get all conversations from user's FB pages
-    conversations = []
-    for page in pages:
-        page_conversations = Conversation.query.filter_by(fb_page_id=page.id).order_by(Conversation.updated_at.desc()).all()
-        conversations.extend(page_conversations)
+    # Get the newest page of conversations from user's FB pages with their
+    # customer and last message in a single query
+    limit = page_size(None)
+    conversations, has_more = keyset_page(
+        conversation_list_query([page.id for page in pages]),
+        Conversation.updated_at, Conversation.id, limit=limit
+    )
+    conversations_cursor = encode_cursor(conversations[-1].updated_at, conversations[-1].id) if has_more else ''
     
-    # Sort conversations by updated_at timestamp (newest first)
-    conversations.sort(key=lambda x: x.updated_at, reverse=True)
+    # Only conversations that changed since their item was last rendered are rendered again;
+    # the open one is marked active, so it is always rendered
+    conversation_items = [render_item(conversation, active=True) if index == 0 else fragment_cache.render(conversation)
+                          for index, conversation in enumerate(conversations)]
+    
+    # Get the latest messages of the first conversation, older ones load on scroll
+    messages, messages_cursor = [], ''
+    if conversations:
+        # Bring back the messages of a conversation that went to the archive, as the API does
+        if conversations[0].archived_at:
+            archive.restore(conversations[0].id)
+        messages, has_more = keyset_page(
+            Message.query.filter_by(conversation_id=conversations[0].id),
+            Message.timestamp, Message.id, limit=limit, newest_first=False
+        )
+        if has_more:
+            messages_cursor = encode_cursor(messages[0].timestamp, messages[0].id)
     
     return render_template('dashboard/index.html', title='Dashboard', 
-                          pages=pages, conversations=conversations,Message=Message)
+                          pages=pages, conversations=conversations, conversation_items=conversation_items,
+                          conversations_cursor=conversations_cursor,
+                          messages=messages, messages_cursor=messages_cursor)
@@ -0,0 +1,177 @@
+"""Full-text search over message history.
+
+Each database uses its own full-text index on message_text:
+
+- SQLite: an FTS5 table, message_search, that indexes the message table
+  without copying it. The write paths add new messages to it in the same
+  transaction that stores them, and `flask search-rebuild` rebuilds it.
+- PostgreSQL: a GIN index on the message text's tsvector.
+- MySQL: a FULLTEXT index.
+
+The server databases keep their index up to date themselves. Queries are
+turned into an AND of words, the last one matching as a prefix, so the
+search box can be typed into; results are ranked by relevance and come
+with a snippet whose matches are wrapped in <mark>.
+"""
+import html
+import re
+import threading
+from sqlalchemy import DDL, event, func, insert, literal_column, select, table, column, text
+from app import db, stats
+from app.models import Conversation, Customer, Message
+from app.serializers import DAY_TIME
+
+SEARCH_TABLE = 'message_search'
+SEARCH_INDEX = 'ix_message_text_search'
+# Postgres only uses the index for this exact expression
+TSVECTOR_SQL = "to_tsvector('simple', coalesce(message_text, ''))"
+TSVECTOR = literal_column(TSVECTOR_SQL)
+
+# Highlight markers put around matches by the database, replaced after the text is escaped
+START, STOP = '\x02', '\x03'
+ELLIPSIS = '…'
+
+_search_table = table(SEARCH_TABLE, column('rowid'), column('message_text'))
+_score = literal_column('score')
+
+_lock = threading.Lock()
+_counters = {'indexed': 0, 'unindexed': 0, 'queries': 0}
+
+# Tables created with create_all get the index too; migrations create it for existing databases
+event.listen(Message.__table__, 'after_create', DDL(
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    f"message_text, content='message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+).execute_if(dialect='sqlite'))
+event.listen(Message.__table__, 'before_drop', DDL(
+    f"DROP TABLE IF EXISTS {SEARCH_TABLE}"
+).execute_if(dialect='sqlite'))
+event.listen(Message.__table__, 'after_create', DDL(
+    f"CREATE INDEX {SEARCH_INDEX} ON message USING gin ({TSVECTOR_SQL})"
+).execute_if(dialect='postgresql'))
+event.listen(Message.__table__, 'after_create', DDL(
+    f"CREATE FULLTEXT INDEX {SEARCH_INDEX} ON message (message_text)"
+).execute_if(dialect='mysql'))
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keep autogenerated migrations from dropping the search index, which has no model"""
+    return not (name or '').startswith((SEARCH_TABLE, SEARCH_INDEX))
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+def index_messages(messages):
+    """Add new, flushed messages to the search index in the current transaction"""
+    if not messages or _dialect() != 'sqlite':
+        return
+    db.session.execute(insert(_search_table), [
+        {'rowid': message.id, 'message_text': message.message_text} for message in messages
+    ])
+    with _lock:
+        _counters['indexed'] += len(messages)
+
+def unindex_messages(messages):
+    """Remove messages about to be deleted from the search index in the current transaction"""
+    if not messages or _dialect() != 'sqlite':
+        return
+    # An FTS5 table without its own copy of the text needs the old values to remove a row
+    db.session.execute(text(
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, message_text) VALUES ('delete', :id, :message_text)"
+    ), [{'id': message.id, 'message_text': message.message_text} for message in messages])
+    with _lock:
+        _counters['unindexed'] += len(messages)
+
+def rebuild():
+    """Rebuild the SQLite search index from the message table, returning False on databases that index themselves"""
+    if _dialect() != 'sqlite':
+        return False
+    db.session.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+    db.session.commit()
+    return True
+
+def parse_terms(query, max_terms):
+    """The lower-cased words of a search query, without any query syntax"""
+    return re.findall(r'\w+', query.lower())[:max_terms]
+
+def search_messages(page_ids, terms, limit, offset=0, snippet_words=12):
+    """Return (results, has_more) for one page of messages of the given pages matching every term
+
+    Results are dicts with the message, conversation and customer fields
+    the API returns, best match first.
+    """
+    with _lock:
+        _counters['queries'] += 1
+    if not page_ids or not terms:
+        return [], False
+
+    columns = (Message.id, Message.conversation_id, Message.seq, Message.sender_type,
+               Message.timestamp, Customer.id.label('customer_id'), Customer.name, Customer.profile_pic)
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        expression = ' '.join(f'"{term}"' for term in terms) + '*'
+        query = select(
+            *columns,
+            func.snippet(literal_column(SEARCH_TABLE), 0, START, STOP, ELLIPSIS, snippet_words).label('snippet'),
+            func.bm25(literal_column(SEARCH_TABLE)).label('score')
+        ).select_from(_search_table).join(
+            Message, Message.id == _search_table.c.rowid
+        ).where(literal_column(SEARCH_TABLE).op('MATCH')(expression)).order_by(_score, Message.id.desc())
+    elif dialect == 'postgresql':
+        tsquery = func.to_tsquery(literal_column("'simple'"), ' & '.join(terms) + ':*')
+        options = f"StartSel={START}, StopSel={STOP}, MaxWords={snippet_words}, MinWords={snippet_words // 2}"
+        query = select(
+            *columns,
+            func.ts_headline(literal_column("'simple'"), Message.message_text, tsquery, options).label('snippet'),
+            func.ts_rank_cd(TSVECTOR, tsquery).label('score')
+        ).where(TSVECTOR.op('@@')(tsquery)).order_by(_score.desc(), Message.id.desc())
+    elif dialect == 'mysql':
+        match = Message.message_text.match(' '.join(f'+{term}' for term in terms) + '*')
+        query = select(*columns, Message.message_text.label('snippet'), match.label('score')) \
+            .where(match).order_by(_score.desc(), Message.id.desc())
+    else:
+        raise NotImplementedError(f"search_messages does not support the {dialect} dialect")
+
+    query = query.join(Conversation, Conversation.id == Message.conversation_id) \
+        .join(Customer, Customer.id == Conversation.customer_id) \
+        .where(Conversation.fb_page_id.in_(page_ids))
+    rows = db.session.execute(query.limit(limit + 1).offset(offset)).all()
+    has_more = len(rows) > limit
+
+    results = []
+    for row in rows[:limit]:
+        # MySQL has no snippet function, so the excerpt is cut here
+        snippet = make_snippet(row.snippet or '', terms, snippet_words) if dialect == 'mysql' else row.snippet
+        results.append({
+            'message_id': row.id,
+            'conversation_id': row.conversation_id,
+            'seq': row.seq,
+            'sender_type': row.sender_type,
+            'timestamp': DAY_TIME(row.timestamp),
+            'snippet': highlight(snippet or ''),
+            'customer': {
+                'id': row.customer_id,
+                'name': row.name,
+                'profile_pic': row.profile_pic
+            }
+        })
+    return results, has_more
+
+def make_snippet(message_text, terms, words=12):
+    """An excerpt of about the given number of words around the first match, with markers around matches"""
+    pattern = re.compile(r'\b(?:' + '|'.join(
+        re.escape(term) + (r'\w*' if i == len(terms) - 1 else r'\b') for i, term in enumerate(terms)
+    ) + ')', re.IGNORECASE)
+    tokens = message_text.split()
+    first = next((i for i, token in enumerate(tokens) if pattern.search(token)), 0)
+    start = max(0, min(first - words // 2, len(tokens) - words))
+    excerpt = ' '.join(pattern.sub(lambda m: START + m.group(0) + STOP, token) for token in tokens[start:start + words])
+    return (ELLIPSIS if start > 0 else '') + excerpt + (ELLIPSIS if start + words < len(tokens) else '')
+
+def highlight(snippet):
+    """HTML-escape a snippet and turn its markers into <mark> tags"""
+    return html.escape(snippet).replace(START, '<mark>').replace(STOP, '</mark>')
+
+def search_stats():
+    with _lock:
+        return dict(_counters)
+
+stats.register('search', search_stats)
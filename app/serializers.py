@@ -0,0 +1,173 @@
+"""Payload serialization shared by the JSON API and Socket.IO.
+
+Models are turned into dicts by Serializers: a fixed list of fields that is
+compiled once into a single function, so serializing a row is one dict
+display instead of a loop over field names. Timestamps are formatted by
+TimeFormat, which remembers the formatted string for each distinct value
+of the fields the format shows (a '%H:%M' format formats each minute of the
+day once).
+
+    MESSAGE = Serializer(id='id', text='message_text', timestamp=('timestamp', TIME))
+    MESSAGE(message)  # {'id': 1, 'text': '...', 'timestamp': '14:05'}
+
+dumps() and loads() encode with orjson when it is installed and with the
+standard json module otherwise. They back Flask's JSON provider (jsonify)
+and the Socket.IO server and message queue.
+"""
+import decimal
+import json
+import uuid
+from datetime import date
+from operator import attrgetter
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson else 'json'
+
+def _default(value):
+    """Values the encoders do not know, handled the way Flask's default provider does"""
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+if orjson:
+    # Datetimes go through _default so they come out as they did with Flask's provider
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def dumps(obj, **kwargs):
+        """Encode obj as compact JSON text; keyword arguments of json.dumps are accepted and ignored"""
+        return dumps_bytes(obj).decode()
+
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+else:
+    _encoder = json.JSONEncoder(default=_default, separators=(',', ':'), ensure_ascii=False)
+
+    def dumps_bytes(obj):
+        return _encoder.encode(obj).encode()
+
+    def dumps(obj, **kwargs):
+        """Encode obj as compact JSON text; keyword arguments of json.dumps are accepted and ignored"""
+        return _encoder.encode(obj)
+
+    def loads(s, **kwargs):
+        return json.loads(s)
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by dumps() and loads()"""
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+# Date and time attributes each strftime directive depends on
+_DIRECTIVE_FIELDS = {
+    'Y': ('year',), 'y': ('year',), 'm': ('month',), 'b': ('month',), 'B': ('month',), 'd': ('day',),
+    'H': ('hour',), 'I': ('hour',), 'p': ('hour',), 'M': ('minute',), 'S': ('second',),
+    'a': ('year', 'month', 'day'), 'A': ('year', 'month', 'day'), 'j': ('year', 'month', 'day'),
+    'w': ('year', 'month', 'day')
+}
+_ALL_FIELDS = ('year', 'month', 'day', 'hour', 'minute', 'second', 'microsecond', 'tzinfo')
+
+class TimeFormat:
+    """strftime with the result remembered per distinct value of the fields the format shows"""
+
+    def __init__(self, format, maxsize=100000):
+        self.format = format
+        self.maxsize = maxsize
+        fields = set()
+        directives = format.split('%')[1:]
+        for directive in directives:
+            # Directives this cache does not know depend on the whole value
+            fields.update(_DIRECTIVE_FIELDS.get(directive[:1], _ALL_FIELDS))
+        self._key = attrgetter(*sorted(fields)) if fields else (lambda value: None)
+        self._cache = {}
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        key = self._key(value)
+        text = self._cache.get(key)
+        if text is None:
+            if len(self._cache) >= self.maxsize:
+                self._cache.clear()
+            text = self._cache[key] = value.strftime(self.format)
+        return text
+
+TIME = TimeFormat('%H:%M')
+DAY_TIME = TimeFormat('%b %d, %H:%M')
+DATE = TimeFormat('%B %d, %Y')
+DATE_TIME = TimeFormat('%B %d, %Y %H:%M')
+
+def preview(text, length=30):
+    """The start of a message as shown in the conversation list"""
+    return text[:length] + ('...' if len(text) > length else '') if text else None
+
+class Serializer:
+    """A fixed set of output fields compiled into a single function
+
+    Each keyword names an output field; its value is an attribute name, an
+    (attribute name, function) pair applied to the attribute, or a function
+    of the whole object.
+    """
+
+    def __init__(self, **fields):
+        self.fields = fields
+        namespace, items = {}, []
+        for index, (name, spec) in enumerate(fields.items()):
+            if isinstance(spec, str):
+                expression = f"obj.{spec}"
+            elif isinstance(spec, tuple):
+                attribute, function = spec
+                namespace[f"_f{index}"] = function
+                expression = f"_f{index}(obj.{attribute})"
+            else:
+                namespace[f"_f{index}"] = spec
+                expression = f"_f{index}(obj)"
+            items.append(f"{name!r}: {expression}")
+        exec(f"def serialize(obj):\n    return {{{', '.join(items)}}}", namespace)
+        self._serialize = namespace['serialize']
+
+    def __call__(self, obj, **extra):
+        data = self._serialize(obj)
+        if extra:
+            data.update(extra)
+        return data
+
+    def many(self, objs):
+        serialize = self._serialize
+        return [serialize(obj) for obj in objs]
+
+CUSTOMER = Serializer(id='id', name='name', profile_pic='profile_pic')
+CUSTOMER_DETAIL = Serializer(id='id', fb_id='fb_id', name='name', profile_pic='profile_pic',
+                             created_at=('created_at', DATE))
+MESSAGE = Serializer(id='id', conversation_id='conversation_id', seq='seq', sender_type='sender_type',
+                     sender_id='sender_id', message_text='message_text', timestamp=('timestamp', TIME),
+                     status='status')
+CONVERSATION_DETAIL = Serializer(id='id', status='status', created_at=('created_at', DATE_TIME),
+                                 updated_at=('updated_at', DATE_TIME), message_count='message_count',
+                                 unread_count='unread_count')
+CONVERSATION_LIST_ITEM = Serializer(id='id', status='status', customer=('customer', CUSTOMER),
+                                    last_message=('last_message_text', preview),
+                                    last_sender_type='last_sender_type', message_count='message_count',
+                                    unread_count='unread_count', updated_at=('updated_at', TIME))
@@ -1,32 +1,87 @@
-from flask import request
+from flask import current_app, request
+from flask_login import current_user
 from flask_socketio import join_room, leave_room, emit
-from app import socketio
+from app import ingest, outbox, socketio
+from app.cache import identity_cache
+from app.log import get_logger
+from app.models import FacebookPage, Message
+from app.realtime import page_room, conversation_room
+from app.serializers import MESSAGE
+
+log = get_logger('socket')
 
 @socketio.on('connect')
 def handle_connect():
-    """Handle client connection"""
-    print(f"Client connected: {request.sid}")
+    """Handle client connection and subscribe the agent to their pages' updates"""
+    if not current_user.is_authenticated:
+        log.info('client_rejected', sid=request.sid)
+        return False
+
+    for (page_id,) in current_user.fb_pages.with_entities(FacebookPage.id):
+        join_room(page_room(page_id))
+    log.info('client_connected', sid=request.sid, user_id=current_user.id)
+
+    # Socket.IO requests bypass before_request, and a dashboard reconnecting to a restarted process
+    # may be the first thing it serves
+    app = current_app._get_current_object()
+    ingest.workers.start(app)
+    outbox.workers.start(app)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
-    print(f"Client disconnected: {request.sid}")
+    log.info('client_disconnected', sid=request.sid)
+
+def owned_conversation_id(data):
+    """The requested conversation id if it belongs to one of the current user's pages"""
+    try:
+        conversation = identity_cache.get_conversation(int(data.get('conversation_id')))
+    except (TypeError, ValueError):
+        return None
+    page = conversation and identity_cache.get_page(conversation.fb_page_id)
+    if not page or page.user_id != current_user.id:
+        return None
+    return conversation.id
 
 @socketio.on('join')
 def handle_join(data):
     """Handle joining a specific conversation room"""
-    conversation_id = data.get('conversation_id')
-    if conversation_id:
-        room = f"conversation_{conversation_id}"
-        join_room(room)
-        print(f"Client {request.sid} joined room: {room}")
-        emit('join_response', {'status': 'success', 'room': room}, room=request.sid)
+    conversation_id = owned_conversation_id(data)
+    if not conversation_id:
+        emit('join_response', {'status': 'error', 'message': 'Conversation not found'}, room=request.sid)
+        return
+
+    room = conversation_room(conversation_id)
+    join_room(room)
+    log.info('room_joined', sid=request.sid, room=room)
+    emit('join_response', {'status': 'success', 'room': room}, room=request.sid)
+    
+    # Replay what a reconnecting client missed; joining first means nothing falls in between
+    try:
+        last_seq = int(data['last_seq'])
+    except (KeyError, TypeError, ValueError):
+        return
+    emit('catch_up', missed_messages(conversation_id, last_seq), room=request.sid)
+
+def missed_messages(conversation_id, last_seq):
+    """Messages of a conversation after last_seq, or has_more if there are too many to replay"""
+    limit = current_app.config['REALTIME_REPLAY_LIMIT']
+    messages = Message.query.filter(
+        Message.conversation_id == conversation_id,
+        Message.seq > last_seq
+    ).order_by(Message.seq).limit(limit + 1).all()
+    
+    return {
+        'conversation_id': conversation_id,
+        'messages': MESSAGE.many(messages[:limit]),
+        'has_more': len(messages) > limit
+    }
 
 @socketio.on('leave')
 def handle_leave(data):
     """Handle leaving a specific conversation room"""
     conversation_id = data.get('conversation_id')
     if conversation_id:
-        room = f"conversation_{conversation_id}"
+        room = conversation_room(conversation_id)
         leave_room(room)
-        print(f"Client {request.sid} left room: {room}")
+        log.info('room_left', sid=request.sid, room=room)
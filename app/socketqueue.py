@@ -0,0 +1,79 @@
+"""Socket.IO message queues shared by several server processes.
+
+Each server process only knows the clients connected to it. With a message
+queue, every emit is published to the queue and each process delivers it to
+its own clients, so rooms span all processes. Redis, Kafka, ZeroMQ and
+Kombu (RabbitMQ and friends) URLs use the managers shipped with
+python-socketio; sqlite:/// URLs use SQLiteManager, a polling stand-in for
+running several processes on one machine in development and tests.
+"""
+import json
+import sqlite3
+import time
+import socketio
+
+def client_manager(url, channel, json=json):
+    """Return the client manager for a message queue URL, or None to keep clients in-process
+
+    json is the module the queue encodes messages with.
+    """
+    if not url:
+        return None
+    if url.startswith('sqlite:///'):
+        return SQLiteManager(url, channel=channel, json=json)
+    if url.startswith(('redis://', 'rediss://')):
+        return socketio.RedisManager(url, channel=channel, json=json)
+    if url.startswith('kafka://'):
+        return socketio.KafkaManager(url, channel=channel, json=json)
+    if url.startswith('zmq'):
+        return socketio.ZmqManager(url, channel=channel, json=json)
+    return socketio.KombuManager(url, channel=channel, json=json)
+
+class SQLiteManager(socketio.PubSubManager):
+    """Publish emits to a SQLite table that every process polls
+
+    Messages are kept for retention seconds, long enough for every
+    listener to pick them up, and then pruned by the publishers.
+    """
+    name = 'sqlite'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None,
+                 poll_interval=0.05, retention=60, json=json):
+        self.path = url[len('sqlite:///'):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._pruned_at = 0
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS socketio_queue ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, '
+                         'payload TEXT NOT NULL, created_at REAL NOT NULL)')
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+
+    def _connect(self):
+        # Autocommit, so every poll sees rows committed by other processes
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def _publish(self, data):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('INSERT INTO socketio_queue (channel, payload, created_at) VALUES (?, ?, ?)',
+                         (self.channel, self.json.dumps(data), now))
+            if now - self._pruned_at > self.retention:
+                conn.execute('DELETE FROM socketio_queue WHERE created_at < ?', (now - self.retention,))
+                self._pruned_at = now
+        finally:
+            conn.close()
+
+    def _listen(self):
+        conn = self._connect()
+        # Only messages published after this process started listening
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM socketio_queue').fetchone()[0]
+        while True:
+            rows = conn.execute('SELECT id, payload FROM socketio_queue WHERE id > ? AND channel = ? ORDER BY id',
+                                (last_id, self.channel)).fetchall()
+            for last_id, payload in rows:
+                yield payload
+            if not rows:
+                self.server.sleep(self.poll_interval)
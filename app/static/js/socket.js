@@ -3,6 +3,8 @@
 // Initialize Socket.IO connection
 let socket = null;
 let currentConversationId = null;
+// Sequence number of the newest message shown for the current conversation
+let lastSeenSeq = null;
 
 function initializeSocket() {
     // Get the host from the current URL
@@ -14,6 +16,9 @@ function initializeSocket() {
     // Connection events
     socket.on('connect', () => {
         console.log('Connected to WebSocket server');
+        
+        // Rooms do not survive a reconnect: rejoin and replay what was missed
+        catchUp();
     });
     
     socket.on('disconnect', () => {
@@ -28,57 +33,232 @@ function initializeSocket() {
     socket.on('new_message', (message) => {
         // If the message belongs to the current conversation, add it to the UI
         if (message.conversation_id == currentConversationId) {
-            addMessageToUI(message);
+            receiveMessages([message]);
         }
     });
     
+    // Messages missed while disconnected, replayed after joining a conversation
+    socket.on('catch_up', (data) => {
+        if (data.conversation_id != currentConversationId) return;
+        
+        if (data.has_more) {
+            // Too far behind to replay, load the conversation afresh
+            loadConversation(currentConversationId);
+        } else {
+            receiveMessages(data.messages);
+        }
+    });
+    
+    // Delivery state of agent replies
+    socket.on('message_status', (message) => {
+        updateMessageStatus(message);
+    });
+    
     // Conversation update events
     socket.on('conversation_update', (data) => {
         updateConversationListItem(data);
     });
     
+    // Customer profile updates once the profile has been fetched
+    socket.on('customer_update', (customer) => {
+        updateCustomerDetails(customer);
+    });
+    
+    // Several events coalesced by the server during a burst
+    socket.on('batch', (frame) => {
+        applyBatch(frame.events);
+    });
+    
     // Join response from server
     socket.on('join_response', (data) => {
         console.log('Joined room:', data.room);
     });
 }
 
-function joinConversationRoom(conversationId) {
+function joinConversationRoom(conversationId, lastSeq = null) {
     // Leave current room if we're in one
-    if (currentConversationId && socket) {
+    if (currentConversationId && socket && socket.connected) {
         socket.emit('leave', { conversation_id: currentConversationId });
     }
     
     // Set new current conversation
     currentConversationId = conversationId;
+    lastSeenSeq = lastSeq;
     
-    // Join new room
-    if (socket && conversationId) {
-        socket.emit('join', { conversation_id: conversationId });
+    // Join new room, or let the connect handler do it once connected
+    if (socket && socket.connected && conversationId) {
+        socket.emit('join', { conversation_id: conversationId, last_seq: lastSeq });
     }
 }
 
-function addMessageToUI(message) {
-    const messagesContainer = document.getElementById('messages-container');
-    if (!messagesContainer) return;
+function receiveMessages(messages) {
+    // Show messages of the current conversation in sequence order, skipping
+    // ones already shown and catching up when some went missing
+    const fresh = [];
+    let gap = false;
+    messages.slice().sort((a, b) => a.seq - b.seq).forEach(message => {
+        if (lastSeenSeq !== null && message.seq <= lastSeenSeq) return;
+        if (lastSeenSeq !== null && message.seq > lastSeenSeq + 1) {
+            gap = true;
+            return;
+        }
+        fresh.push(message);
+        lastSeenSeq = message.seq;
+    });
     
+    addMessagesToUI(fresh);
+    if (gap) {
+        catchUp();
+    }
+}
+
+function catchUp() {
+    // Ask the server for the current conversation's messages after the last one shown
+    if (socket && socket.connected && currentConversationId) {
+        socket.emit('join', { conversation_id: currentConversationId, last_seq: lastSeenSeq });
+    }
+}
+
+function renderMessage(message) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `d-flex ${message.sender_type === 'agent' ? 'justify-content-end' : 'justify-content-start'}`;
+    messageDiv.setAttribute('data-message-id', message.id);
     
     messageDiv.innerHTML = `
         <div class="message ${message.sender_type}">
             ${message.message_text}
-            <div class="small mt-1 text-muted">${message.timestamp}</div>
+            <div class="small mt-1 text-muted">${message.timestamp} <span class="message-status"></span></div>
         </div>
     `;
+    setMessageStatus(messageDiv, message);
     
-    messagesContainer.appendChild(messageDiv);
+    return messageDiv;
+}
+
+function setMessageStatus(messageDiv, message) {
+    // Show the delivery state of agent replies until they are sent
+    const status = messageDiv ? messageDiv.querySelector('.message-status') : null;
+    if (!status) return;
+    
+    const failed = message.status === 'failed';
+    status.textContent = failed ? '\u00b7 Not delivered' :
+        (message.status === 'pending' || message.status === 'sending') ? '\u00b7 Sending...' : '';
+    status.classList.toggle('text-danger', failed);
+    status.title = failed && message.error ? message.error : '';
+}
+
+function updateMessageStatus(message) {
+    setMessageStatus(document.querySelector(`[data-message-id="${message.id}"]`), message);
+}
+
+function addMessageToUI(message) {
+    addMessagesToUI([message]);
+}
+
+function addMessagesToUI(messages) {
+    const messagesContainer = document.getElementById('messages-container');
+    if (!messagesContainer || !messages.length) return;
+    
+    const fragment = document.createDocumentFragment();
+    messages.forEach(message => {
+        fragment.appendChild(renderMessage(message));
+    });
+    messagesContainer.appendChild(fragment);
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
 }
 
+function applyBatch(events) {
+    // Apply a batch frame with one insertion into each list
+    const messages = [];
+    const updates = [];
+    events.forEach(([name, data]) => {
+        if (name === 'new_message') {
+            if (data.conversation_id == currentConversationId) {
+                messages.push(data);
+            }
+        } else if (name === 'conversation_update') {
+            updates.push(data);
+        } else if (name === 'customer_update') {
+            updateCustomerDetails(data);
+        }
+    });
+    
+    receiveMessages(messages);
+    updateConversationListItems(updates);
+    
+    // Status updates may refer to messages added just above
+    events.forEach(([name, data]) => {
+        if (name === 'message_status') {
+            updateMessageStatus(data);
+        }
+    });
+}
+
+let loadingOlderMessages = false;
+
+function loadOlderMessages() {
+    const messagesContainer = document.getElementById('messages-container');
+    if (!messagesContainer || !currentConversationId || loadingOlderMessages) return;
+    
+    const cursor = messagesContainer.getAttribute('data-before-cursor');
+    if (!cursor) return;
+    
+    const conversationId = currentConversationId;
+    loadingOlderMessages = true;
+    fetch(`/api/conversation/${conversationId}?before=${encodeURIComponent(cursor)}`)
+    .then(response => response.json())
+    .then(data => {
+        // Ignore the page if the agent switched conversations meanwhile
+        if (!data.success || conversationId !== currentConversationId) return;
+        
+        // Prepend the older messages and keep the visible ones in place
+        const previousHeight = messagesContainer.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        data.messages.forEach(message => {
+            fragment.appendChild(renderMessage(message));
+        });
+        messagesContainer.insertBefore(fragment, messagesContainer.firstChild);
+        messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+        
+        messagesContainer.setAttribute('data-before-cursor', data.has_more ? data.cursors.before : '');
+    })
+    .catch(error => {
+        console.error('Error loading older messages:', error);
+    })
+    .finally(() => {
+        loadingOlderMessages = false;
+    });
+}
+
 function updateConversationListItem(data) {
+    updateConversationListItems([data]);
+}
+
+function updateConversationListItems(updates) {
+    const conversationList = document.getElementById('conversation-list');
+    const moved = document.createDocumentFragment();
+    const seen = new Set();
+    
+    // The last update is the most recent one, so it has to end up on top
+    updates.slice().reverse().forEach(data => {
+        if (seen.has(data.conversation_id)) return;
+        seen.add(data.conversation_id);
+        
+        const conversationItem = updateConversationItemContent(data);
+        if (conversationItem) {
+            moved.appendChild(conversationItem);
+        }
+    });
+    
+    // Move the updated conversations to the top of the list in one step
+    if (conversationList && moved.childNodes.length) {
+        conversationList.insertBefore(moved, conversationList.firstChild);
+    }
+}
+
+function updateConversationItemContent(data) {
     const conversationItem = document.querySelector(`.conversation-item[data-conversation-id="${data.conversation_id}"]`);
-    if (!conversationItem) return;
+    if (!conversationItem) return null;
     
     // Update the last message text
     const messagePreview = conversationItem.querySelector('p.text-muted');
@@ -92,10 +272,48 @@ function updateConversationListItem(data) {
         timestamp.textContent = data.updated_at;
     }
     
-    // Move conversation to top of list if not already
-    const conversationList = document.getElementById('conversation-list');
-    if (conversationList && conversationList.firstChild !== conversationItem) {
-        conversationList.insertBefore(conversationItem, conversationList.firstChild);
+    // Update the unread badge, the open conversation is being read already
+    if (data.unread_count !== undefined) {
+        setUnreadCount(conversationItem, data.conversation_id == currentConversationId ? 0 : data.unread_count);
+    }
+    
+    return conversationItem;
+}
+
+function setUnreadCount(conversationItem, count) {
+    const badge = conversationItem ? conversationItem.querySelector('.unread-count') : null;
+    if (!badge) return;
+    
+    badge.textContent = count || '';
+    badge.classList.toggle('d-none', !count);
+}
+
+function updateCustomerDetails(customer) {
+    // Update every conversation of this customer in the list
+    document.querySelectorAll(`.conversation-item[data-customer-id="${customer.id}"]`).forEach(item => {
+        const name = item.querySelector('h6');
+        if (name) {
+            name.textContent = customer.name;
+        }
+        
+        const profilePic = item.querySelector('img.profile-pic');
+        if (profilePic && customer.profile_pic) {
+            profilePic.src = customer.profile_pic;
+            profilePic.alt = customer.name;
+        }
+    });
+    
+    // Refresh the header and profile panel if the open conversation belongs to this customer
+    const activeConversation = document.querySelector('.conversation-item.active');
+    if (activeConversation && activeConversation.getAttribute('data-customer-id') == customer.id) {
+        const headerName = document.querySelector('.message-header h6');
+        if (headerName) {
+            headerName.textContent = customer.name;
+        }
+        
+        if (typeof updateCustomerProfile === 'function') {
+            updateCustomerProfile(customer);
+        }
     }
 }
 
@@ -106,7 +324,18 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Get the initial conversation ID
     const activeConversation = document.querySelector('.conversation-item.active');
+    const messagesContainer = document.getElementById('messages-container');
     if (activeConversation) {
-        joinConversationRoom(activeConversation.getAttribute('data-conversation-id'));
+        const lastSeq = messagesContainer ? parseInt(messagesContainer.getAttribute('data-last-seq'), 10) : NaN;
+        joinConversationRoom(activeConversation.getAttribute('data-conversation-id'), isNaN(lastSeq) ? null : lastSeq);
+    }
+    
+    // Load older messages when the history is scrolled to the top
+    if (messagesContainer) {
+        messagesContainer.addEventListener('scroll', function() {
+            if (this.scrollTop < 50) {
+                loadOlderMessages();
+            }
+        });
     }
 });
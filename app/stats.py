@@ -0,0 +1,15 @@
+"""Registry of runtime statistics exposed through /api/stats and /metrics"""
+
+_providers = {}
+
+def register(name, provider):
+    """Register a callable returning a dict of stats under the given name"""
+    _providers[name] = provider
+
+def providers():
+    """The registered (name, provider) pairs"""
+    return list(_providers.items())
+
+def snapshot():
+    """Collect the current stats from every registered provider"""
+    return {name: provider() for name, provider in _providers.items()}
@@ -0,0 +1,31 @@
+"""Race-free inserts backed by unique constraints.
+
+Concurrent webhook workers may try to create the same customer or
+conversation at the same time. Instead of checking first and inserting
+second, rows are inserted with the database's own conflict handling
+(INSERT ... ON CONFLICT DO NOTHING on SQLite and PostgreSQL, INSERT ... ON
+DUPLICATE KEY UPDATE on MySQL) and then read back, so every worker ends
+up with the same row and none of them fails on the unique constraint.
+"""
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from app import db
+
+def insert_or_ignore(model, rows, conflict_column):
+    """Insert rows into model's table, skipping those whose conflict_column value already exists"""
+    if not rows:
+        return
+
+    table = model.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        statement = sqlite.insert(table).on_conflict_do_nothing(index_elements=[conflict_column])
+    elif dialect == 'postgresql':
+        statement = postgresql.insert(table).on_conflict_do_nothing(index_elements=[conflict_column])
+    elif dialect == 'mysql':
+        # A no-op assignment turns the duplicate key error into "0 rows affected"
+        statement = mysql.insert(table)
+        statement = statement.on_duplicate_key_update({conflict_column: statement.inserted[conflict_column]})
+    else:
+        raise NotImplementedError(f"insert_or_ignore does not support the {dialect} dialect")
+
+    db.session.execute(statement, rows)
@@ -0,0 +1,64 @@
+"""Background task pools shared by the ingestion queue, outbox, profile enrichment and archiving.
+
+A pool is started once per server process, the first time it is needed:
+with the first request the process handles (registered by init_app), a
+Socket.IO connection, or the first job handed to it. CLI commands never
+start one, and a pool whose size setting is 0 never starts at all, so its
+caller does the work inline instead.
+"""
+import threading
+from app import db, socketio
+
+
+class WorkerPool:
+    """A fixed number of background tasks started at most once per process
+
+    setting is the config key that enables the pool when positive and, unless
+    tasks is given, also sets how many tasks run. Each task is called as
+    target(app, index). setup(app) runs once before the first task starts.
+    """
+
+    def __init__(self, target, setting, tasks=None, setup=None):
+        self.target = target
+        self.setting = setting
+        self.tasks = tasks
+        self.setup = setup
+        self.started = 0
+        self._lock = threading.Lock()
+
+    def enabled(self, app):
+        return app.config[self.setting] > 0
+
+    def init_app(self, app):
+        """Start the pool with the first request the app serves"""
+        if self.enabled(app):
+            app.before_request(lambda: self.start(app))
+
+    def start(self, app):
+        """Start the tasks unless this process already has"""
+        if self.started or not self.enabled(app):
+            return
+
+        with self._lock:
+            if self.started:
+                return
+            if self.setup:
+                self.setup(app)
+            tasks = self.tasks or app.config[self.setting]
+            for index in range(tasks):
+                socketio.start_background_task(self.target, app, index)
+            self.started = tasks
+
+
+def run_task(log, error_event, fn, *args, **fields):
+    """Run one unit of a worker's loop in its own session
+
+    An exception is rolled back and logged instead of ending the worker.
+    """
+    try:
+        return fn(*args)
+    except Exception as e:
+        db.session.rollback()
+        log.error(error_event, error=str(e), **fields)
+    finally:
+        db.session.remove()
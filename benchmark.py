@@ -0,0 +1,931 @@
+#!/usr/bin/env python3
+"""Benchmarks for the helpdesk's hot database paths.
+
+Each benchmark builds its own throwaway database (SQLite in a temporary
+directory unless --database-url is given) so it never touches instance/app.db.
+
+    python benchmark.py indexes --messages 1000000
+    python benchmark.py race --workers 8
+    python benchmark.py scaleout --message-queue redis://localhost:6379/0
+    python benchmark.py throttle --rate 20 --graph-page-rate 25
+    python benchmark.py writes --writers 8
+    python benchmark.py serialize --messages 10000
+    python benchmark.py queries
+    python benchmark.py archive
+"""
+import argparse
+import bisect
+import json
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, insert, update
+from sqlalchemy.exc import OperationalError
+from app import create_app, db, socketio
+from app.models import User, FacebookPage, Customer, Conversation, Message
+from config import Config
+
+def make_app(database_url, **settings):
+    """Create an app bound to the benchmark database with background workers disabled"""
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        WEBHOOK_QUEUE_WORKERS = 0
+        PROFILE_ENRICH_WORKERS = 0
+        OUTBOX_WORKERS = 0
+        REALTIME_BATCH_WINDOW_MS = 0
+
+    for name, value in settings.items():
+        setattr(BenchmarkConfig, name, value)
+    return create_app(BenchmarkConfig)
+
+def seed(pages=5, customers=20000, messages=1000000, days=60, chunk=50000):
+    """Fill the database with users, pages, customers, conversations and messages"""
+    now = datetime.utcnow()
+    rng = random.Random(42)
+
+    user = User(username='bench', email='bench@example.com')
+    user.set_password('benchpass')
+    db.session.add(user)
+    db.session.flush()
+
+    db.session.execute(insert(FacebookPage), [
+        {'page_id': f"page-{i}", 'page_name': f"Page {i}", 'access_token': 'token', 'user_id': user.id}
+        for i in range(pages)
+    ])
+    db.session.execute(insert(Customer), [
+        {'fb_id': f"customer-{i}", 'name': f"Customer {i}", 'profile_pic': ''}
+        for i in range(customers)
+    ])
+    page_ids = [page.id for page in FacebookPage.query.all()]
+    customer_ids = [customer.id for customer in Customer.query.all()]
+
+    db.session.execute(insert(Conversation), [
+        {
+            'fb_page_id': page_ids[i % len(page_ids)],
+            'customer_id': customer_id,
+            'status': 'open',
+            'active_key': Conversation.make_active_key(customer_id, page_ids[i % len(page_ids)]),
+            'created_at': now - timedelta(days=days),
+            'updated_at': now - timedelta(seconds=rng.randint(0, days * 86400))
+        }
+        for i, customer_id in enumerate(customer_ids)
+    ])
+    conversation_ids = [id for (id,) in db.session.query(Conversation.id)]
+    db.session.commit()
+
+    counts = dict.fromkeys(conversation_ids, 0)
+    for start in range(0, messages, chunk):
+        rows = []
+        for n in range(start, min(start + chunk, messages)):
+            conversation_id = rng.choice(conversation_ids)
+            counts[conversation_id] += 1
+            rows.append({
+                'conversation_id': conversation_id,
+                'seq': counts[conversation_id],
+                'sender_type': rng.choice(('customer', 'agent')),
+                'sender_id': 'bench',
+                'message_text': f"benchmark message {n}",
+                'timestamp': now - timedelta(seconds=rng.randint(0, days * 86400))
+            })
+        db.session.execute(insert(Message), rows)
+        db.session.commit()
+        print(f"  seeded {min(start + chunk, messages)}/{messages} messages", end='\r', flush=True)
+    print()
+
+    # New messages continue each conversation's numbering
+    db.session.execute(update(Conversation), [
+        {'id': id, 'message_count': count} for id, count in counts.items()
+    ])
+    db.session.commit()
+
+class StatementRecorder:
+    """Remember the last SQL statement executed so its plan can be explained"""
+
+    def __init__(self, engine):
+        self.statement = None
+        self.parameters = None
+        event.listen(engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith('EXPLAIN'):
+            self.statement, self.parameters = statement, parameters
+
+    def explain(self):
+        engine = db.engine
+        prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+        with engine.connect() as conn:
+            rows = conn.exec_driver_sql(prefix + self.statement, self.parameters).fetchall()
+        return [' '.join(str(column) for column in row) for row in rows]
+
+def time_query(run, repeat):
+    """Return (median, p95) latency in milliseconds of calling run()"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000)
+        db.session.rollback()
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+def hot_queries():
+    """The read paths the composite indexes are meant to serve"""
+    from app.pagination import keyset_page
+    from app.queries import conversation_list_query
+    from app.routes.api import find_or_create_conversations
+
+    page_ids = [page.id for page in FacebookPage.query.all()]
+    busiest = db.session.query(Message.conversation_id).group_by(Message.conversation_id) \
+        .order_by(db.func.count().desc()).first()[0]
+    conversation = db.session.get(Conversation, busiest)
+    pair = {(conversation.customer_id, conversation.fb_page_id)}
+
+    # Keep the conversation inside the 24h window so the lookup finds it
+    conversation.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    return {
+        'find_or_create_conversations': lambda: find_or_create_conversations(pair),
+        'conversation_list': lambda: keyset_page(
+            conversation_list_query(page_ids), Conversation.updated_at, Conversation.id, limit=50),
+        'message_history': lambda: keyset_page(
+            Message.query.filter_by(conversation_id=busiest),
+            Message.timestamp, Message.id, limit=50, newest_first=False)
+    }
+
+def report_queries(label, recorder, repeat):
+    print(f"\n== {label} ==")
+    for name, run in hot_queries().items():
+        median, p95 = time_query(run, repeat)
+        print(f"{name}: median {median:.2f} ms, p95 {p95:.2f} ms")
+        for line in recorder.explain():
+            print(f"    {line}")
+
+def analyze():
+    """Refresh planner statistics after changing indexes"""
+    statement = 'ANALYZE TABLE conversation, message' if db.engine.dialect.name == 'mysql' else 'ANALYZE'
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql(statement)
+        conn.commit()
+
+def bench_indexes(args):
+    """Compare hot query plans and latencies without and with the composite indexes"""
+    app = make_app(args.database_url)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        print(f"Seeding {args.messages} messages on {db.engine.url.render_as_string()}")
+        seed(customers=args.customers, messages=args.messages)
+        recorder = StatementRecorder(db.engine)
+
+        # Unique indexes stay, find_or_create_conversations relies on them
+        indexes = [index for model in (Conversation, Message) for index in model.__table__.indexes
+                   if not index.unique]
+        for index in indexes:
+            index.drop(db.engine)
+        analyze()
+        report_queries('without composite indexes', recorder, args.repeat)
+
+        for index in indexes:
+            index.create(db.engine)
+        analyze()
+        report_queries('with composite indexes', recorder, args.repeat)
+
+def race_round(app, page, sender, workers, events, attempts):
+    """Deliver events from one sender on parallel workers, returning (retries, failures)"""
+    from app.routes.api import process_webhook_payload
+
+    barrier = threading.Barrier(workers)
+    outcome = {'retries': 0, 'failures': 0}
+    lock = threading.Lock()
+
+    def deliver(worker):
+        with app.app_context():
+            barrier.wait()
+            for n in range(events):
+                payload = {'object': 'page', 'entry': [{'id': page, 'messaging': [{
+                    'sender': {'id': sender},
+                    'recipient': {'id': page},
+                    'timestamp': int(time.time() * 1000),
+                    'message': {'text': f"race {worker}-{n}"}
+                }]}]}
+                # Retry like the webhook queue does when the database is busy
+                for attempt in range(attempts):
+                    try:
+                        process_webhook_payload(payload)
+                        break
+                    except OperationalError:
+                        with lock:
+                            outcome['retries'] += 1
+                        time.sleep(0.01 * (attempt + 1))
+                else:
+                    with lock:
+                        outcome['failures'] += 1
+            db.session.remove()
+
+    threads = [threading.Thread(target=deliver, args=(worker,)) for worker in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcome['retries'], outcome['failures']
+
+def bench_race(args):
+    """Deliver events from one new sender on parallel workers and check nothing is duplicated or lost"""
+    from fake_graph import FakeGraphServer
+
+    # The new sender's profile is fetched inline, so keep that off the real Graph API
+    graph_server = FakeGraphServer().start()
+    app = make_app(args.database_url, GRAPH_API_URL=graph_server.url)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('benchpass')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(FacebookPage(page_id='race-page', page_name='Race', access_token='token', user_id=user.id))
+        db.session.commit()
+
+    ok = True
+    expected = 0
+    # The second round starts after the conversation fell out of the 24h window
+    for round, (label, conversations) in enumerate((('new sender', 1), ('expired conversation', 2))):
+        if round:
+            with app.app_context():
+                Conversation.query.update({'updated_at': datetime.utcnow() - timedelta(hours=25)})
+                db.session.commit()
+
+        retries, failures = race_round(app, 'race-page', 'race-sender', args.workers, args.events, args.attempts)
+        expected += args.workers * args.events
+
+        with app.app_context():
+            counts = {
+                'customers': Customer.query.filter_by(fb_id='race-sender').count(),
+                'conversations': Conversation.query.count(),
+                'active conversations': Conversation.query.filter(Conversation.active_key.isnot(None)).count(),
+                'messages': Message.query.count()
+            }
+        wanted = {'customers': 1, 'conversations': conversations, 'active conversations': 1, 'messages': expected}
+        passed = counts == wanted and not failures
+        ok = ok and passed
+
+        print(f"\n== {label}: {args.workers} workers x {args.events} events ==")
+        for name, count in counts.items():
+            print(f"{name}: {count} (expected {wanted[name]})")
+        print(f"retries: {retries}, failed deliveries: {failures}")
+        print('PASS' if passed else 'FAIL')
+
+    graph_server.stop()
+    return 0 if ok else 1
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+def session_cookie(app, user_id):
+    """A signed session cookie logging the given user in"""
+    serializer = app.session_interface.get_signing_serializer(app)
+    return f"{app.config['SESSION_COOKIE_NAME']}={serializer.dumps({'_user_id': str(user_id), '_fresh': True})}"
+
+WEBHOOK_SECRET = 'benchmark-secret'
+
+def serve_node(database_url, message_queue, graph_url, port):
+    """Run one Socket.IO server process sharing the database and message queue"""
+    class NodeConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_url
+        SOCKETIO_MESSAGE_QUEUE = message_queue
+        GRAPH_API_URL = graph_url
+        FB_APP_SECRET = WEBHOOK_SECRET
+
+    sys.stdout = sys.stderr = open(os.devnull, 'w')
+    app = create_app(NodeConfig)
+    socketio.run(app, port=port, allow_unsafe_werkzeug=True, log_output=False)
+
+def bench_scaleout(args):
+    """Check that an emit from the process handling a webhook reaches an agent connected to another process"""
+    import requests
+    import socketio as socketio_client
+    from app.signature import sign
+    from fake_graph import FakeGraphServer
+
+    app = make_app(args.database_url)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('benchpass')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(FacebookPage(page_id='scale-page', page_name='Scale', access_token='token', user_id=user.id))
+        db.session.commit()
+        cookie = session_cookie(app, user.id)
+
+    message_queue = args.message_queue or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'socketio-queue.db')}"
+    graph_server = FakeGraphServer().start()
+    context = multiprocessing.get_context('spawn')
+    ports = [free_port(), free_port()]
+    nodes = [context.Process(target=serve_node, args=(args.database_url, message_queue, graph_server.url, port),
+                             daemon=True)
+             for port in ports]
+    for node in nodes:
+        node.start()
+
+    received = {'conversation_update': [], 'new_message': []}
+    arrived = threading.Condition()
+    client = socketio_client.Client()
+
+    def recorder(name):
+        def record(data):
+            with arrived:
+                received[name].append((time.perf_counter(), data))
+                arrived.notify_all()
+        return record
+
+    for name in received:
+        client.on(name, recorder(name))
+
+    @client.on('batch')
+    def record_batch(frame):
+        for name, data in frame['events']:
+            if name in received:
+                recorder(name)(data)
+
+    def wait_for(name, predicate, timeout=10):
+        with arrived:
+            arrived.wait_for(lambda: any(predicate(data) for _, data in received[name]), timeout)
+            return next(((at, data) for at, data in received[name] if predicate(data)), (None, None))
+
+    def deliver(text):
+        payload = {'object': 'page', 'entry': [{'id': 'scale-page', 'messaging': [{
+            'sender': {'id': 'scale-sender'},
+            'recipient': {'id': 'scale-page'},
+            'timestamp': int(time.time() * 1000),
+            'message': {'text': text}
+        }]}]}
+        body = json.dumps(payload).encode()
+        requests.post(f"http://127.0.0.1:{ports[0]}/api/webhook", data=body, headers={
+            'Content-Type': 'application/json',
+            'X-Hub-Signature-256': sign(body, WEBHOOK_SECRET)
+        }).raise_for_status()
+
+    try:
+        for port in ports:
+            wait_for_port(port)
+        print(f"Webhooks go to port {ports[0]}, the agent listens on port {ports[1]}, queue {message_queue}")
+        client.connect(f"http://127.0.0.1:{ports[1]}", headers={'Cookie': cookie})
+
+        # The first message creates the conversation the agent then joins
+        deliver('scale 0')
+        _, update = wait_for('conversation_update', lambda data: True)
+        if not update:
+            print('FAIL: conversation_update from the other process never arrived')
+            return 1
+        client.call('join', {'conversation_id': update['conversation_id']}, timeout=10)
+
+        latencies, lost = [], 0
+        for n in range(1, args.messages + 1):
+            sent = time.perf_counter()
+            deliver(f"scale {n}")
+            at, _ = wait_for('new_message', lambda data: data['message_text'] == f"scale {n}")
+            if at is None:
+                lost += 1
+            else:
+                latencies.append((at - sent) * 1000)
+
+        print(f"delivered {len(latencies)}/{args.messages} messages across processes")
+        if latencies:
+            latencies.sort()
+            print(f"webhook to agent latency: median {statistics.median(latencies):.1f} ms, "
+                  f"p95 {latencies[max(int(len(latencies) * 0.95) - 1, 0)]:.1f} ms")
+        print('PASS' if not lost else 'FAIL')
+        return 1 if lost else 0
+    finally:
+        client.disconnect()
+        for node in nodes:
+            node.terminate()
+        graph_server.stop()
+
+def bench_throttle(args):
+    """Send replies on a busy page and quiet pages through the outbox against a rate-limited fake Graph"""
+    from app import outbox
+    from fake_graph import FakeGraphServer
+
+    graph_server = FakeGraphServer(page_rate=args.graph_page_rate, rate_limit_every=args.rate_limit_every).start()
+
+    class ThrottleConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_url
+        GRAPH_API_URL = graph_server.url
+        WEBHOOK_QUEUE_WORKERS = 0
+        PROFILE_ENRICH_WORKERS = 0
+        OUTBOX_WORKERS = args.workers
+        OUTBOX_POLL_INTERVAL = 0.5
+        OUTBOX_RETRY_BACKOFF = 0.1
+        OUTBOX_PAGE_RATE = args.rate
+        OUTBOX_PAGE_BURST = args.burst
+
+    app = create_app(ThrottleConfig)
+    # The busy page writes all its replies first, the quiet pages right after it
+    plan = [('busy', args.busy)] + [(f"quiet-{n}", args.quiet) for n in range(args.pages - 1)]
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('benchpass')
+        db.session.add(user)
+        db.session.flush()
+
+        conversations = {}
+        for name, _ in plan:
+            page = FacebookPage(page_id=name, page_name=name, access_token=f"token-{name}", user_id=user.id)
+            customer = Customer(fb_id=f"customer-{name}", name=name, profile_pic='')
+            db.session.add_all([page, customer])
+            db.session.flush()
+            conversations[name] = Conversation(fb_page_id=page.id, customer_id=customer.id)
+        db.session.add_all(conversations.values())
+        db.session.flush()
+
+        queued = []
+        for name, count in plan:
+            conversation = conversations[name]
+            messages = [Message(conversation_id=conversation.id, sender_type='agent', sender_id=str(user.id),
+                                message_text=f"{name} {n}", seq=n + 1, status='pending')
+                        for n in range(count)]
+            db.session.add_all(messages)
+            db.session.flush()
+            queued.extend((message.id, conversation.fb_page_id) for message in messages)
+        db.session.commit()
+
+        started = time.monotonic()
+        for message_id, fb_page_id in queued:
+            outbox.enqueue(message_id, fb_page_id)
+
+        deadline = started + args.timeout
+        while time.monotonic() < deadline:
+            if not Message.query.filter(Message.status.in_(['pending', 'sending'])).count():
+                break
+            time.sleep(0.2)
+            db.session.remove()
+        elapsed = time.monotonic() - started
+        statuses = dict(db.session.query(Message.status, func.count()).group_by(Message.status).all())
+        pages = outbox.outbox_stats().get('pages', {})
+
+    graph_server.stop()
+    rejected = sum(1 for method, path, params, body in graph_server.requests if path.endswith('me/messages')) \
+        - sum(len(sends) for sends in graph_server.sends.values())
+
+    print(f"\n== {args.pages} pages, limiter {args.rate:g}/s burst {args.burst}, "
+          f"Graph allows {args.graph_page_rate or 'unlimited'}/s per page ==")
+    print(f"{'page':<10} {'sent':>5} {'done after':>11} {'peak/s':>7} {'throttled':>10}")
+    finished = {}
+    for name, count in plan:
+        sends = graph_server.sends.get(f"token-{name}", [])
+        finished[name] = sends[-1] - started if sends else None
+        # Most sends that fell within any one second
+        peak = max((bisect.bisect_right(sends, at + 1) - i for i, at in enumerate(sends)), default=0)
+        done = f"{finished[name]:.2f} s" if finished[name] is not None else '-'
+        print(f"{name:<10} {len(sends):>5} {done:>11} {peak:>7} {pages.get(name, {}).get('throttled_seconds', 0):>9.2f}s")
+    print(f"statuses: {statuses}, rate-limit errors from Graph: {rejected}, total {elapsed:.2f} s")
+
+    quiet = [at for name, at in finished.items() if name != 'busy']
+    ok = set(statuses) == {'sent'} and all(at is not None for at in finished.values())
+    # Fair scheduling: quiet pages must not wait for the busy page's backlog
+    fair = ok and (not quiet or max(quiet) < finished['busy'])
+    print('PASS' if ok and fair else 'FAIL')
+    return 0 if ok and fair else 1
+
+def writes_round(app, writers, readers, events, attempts):
+    """Store webhook events from new senders on parallel writers while readers list conversations"""
+    from app.queries import conversation_list_query
+    from app.routes.api import process_webhook_payload
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('benchpass')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(FacebookPage(page_id='writes-page', page_name='Writes', access_token='token', user_id=user.id))
+        db.session.commit()
+        page_ids = [page.id for page in FacebookPage.query.all()]
+
+    barrier = threading.Barrier(writers + readers + 1)
+    done = threading.Event()
+    lock = threading.Lock()
+    outcome = {'latencies': [], 'retries': 0, 'failures': 0, 'reads': 0}
+
+    def write(worker):
+        latencies, retries, failures = [], 0, 0
+        with app.app_context():
+            barrier.wait()
+            for n in range(events):
+                # Each event comes from a new sender, creating a customer, a conversation and a message
+                payload = {'object': 'page', 'entry': [{'id': 'writes-page', 'messaging': [{
+                    'sender': {'id': f"writer-{worker}-{n}"},
+                    'recipient': {'id': 'writes-page'},
+                    'timestamp': int(time.time() * 1000),
+                    'message': {'mid': f"writes-{worker}-{n}", 'text': f"write {worker}-{n}"}
+                }]}]}
+                started = time.perf_counter()
+                for attempt in range(attempts):
+                    try:
+                        process_webhook_payload(payload)
+                        latencies.append(time.perf_counter() - started)
+                        break
+                    except OperationalError:
+                        retries += 1
+                        time.sleep(0.01 * (attempt + 1))
+                else:
+                    failures += 1
+            db.session.remove()
+        with lock:
+            outcome['latencies'].extend(latencies)
+            outcome['retries'] += retries
+            outcome['failures'] += failures
+
+    def read():
+        reads = 0
+        with app.app_context():
+            barrier.wait()
+            while not done.is_set():
+                try:
+                    conversation_list_query(page_ids).order_by(Conversation.updated_at.desc()).limit(50).all()
+                    reads += 1
+                except OperationalError:
+                    pass
+                db.session.remove()
+        with lock:
+            outcome['reads'] += reads
+
+    writer_threads = [threading.Thread(target=write, args=(worker,)) for worker in range(writers)]
+    reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+    for thread in writer_threads + reader_threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in writer_threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    for thread in reader_threads:
+        thread.join()
+
+    with app.app_context():
+        stored = Message.query.count()
+    return dict(outcome, elapsed=elapsed, stored=stored)
+
+def bench_writes(args):
+    """Compare concurrent webhook write throughput with and without the database profile's tuning"""
+    from fake_graph import FakeGraphServer
+
+    # Every writer is a new sender whose profile is fetched inline, so keep that off the real Graph API
+    graph_server = FakeGraphServer().start()
+    if args.database_url.startswith('sqlite:'):
+        directory = tempfile.mkdtemp()
+        runs = [(profile, f"sqlite:///{os.path.join(directory, f'writes-{profile}.db')}")
+                for profile in ('plain', 'auto')]
+    else:
+        runs = [(profile, args.database_url) for profile in ('plain', 'auto')]
+
+    expected = args.writers * args.events
+    ok = True
+    print(f"{args.writers} writers x {args.events} events, {args.readers} readers")
+    print(f"{'profile':<8} {'events/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'reads/s':>8} {'retries':>8} {'failed':>7}")
+    for profile, database_url in runs:
+        app = make_app(database_url, DATABASE_PROFILE=profile, GRAPH_API_URL=graph_server.url, LOG_LEVEL='ERROR')
+        result = writes_round(app, args.writers, args.readers, args.events, args.attempts)
+        latencies = sorted(result['latencies']) or [0]
+        print(f"{profile:<8} {len(result['latencies']) / result['elapsed']:>9.1f} "
+              f"{statistics.median(latencies) * 1000:>8.1f} "
+              f"{latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000:>8.1f} "
+              f"{result['reads'] / result['elapsed']:>8.1f} {result['retries']:>8} {result['failures']:>7}")
+        ok = ok and result['stored'] == expected - result['failures']
+        with app.app_context():
+            db.engine.dispose()
+
+    graph_server.stop()
+    print('PASS' if ok else 'FAIL: stored messages do not match successful writes')
+    return 0 if ok else 1
+
+def legacy_message_data(messages):
+    """Message dicts built by hand as get_conversation did before app.serializers"""
+    return [{
+        'id': message.id,
+        'seq': message.seq,
+        'sender_type': message.sender_type,
+        'sender_id': message.sender_id,
+        'message_text': message.message_text,
+        'timestamp': message.timestamp.strftime('%H:%M'),
+        'status': message.status
+    } for message in messages]
+
+def bench_serialize(args):
+    """Cost of turning a long conversation's messages into a JSON response, by serializer and encoder"""
+    from flask.json.provider import DefaultJSONProvider
+    from app import serializers
+
+    app = make_app(args.database_url, LOG_LEVEL='ERROR')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        rng = random.Random(42)
+        user = User(username='bench', email='bench@example.com')
+        db.session.add(user)
+        db.session.flush()
+        page = FacebookPage(page_id='page-0', page_name='Page 0', access_token='token', user_id=user.id)
+        customer = Customer(fb_id='customer-0', name='Customer 0', profile_pic='')
+        db.session.add_all([page, customer])
+        db.session.flush()
+        conversation = Conversation(fb_page_id=page.id, customer_id=customer.id, message_count=args.messages)
+        db.session.add(conversation)
+        db.session.flush()
+        started_at = datetime.utcnow() - timedelta(days=30)
+        words = ['order', 'refund', 'delivery', 'thanks', 'hello', 'café', 'size', 'colour', 'when', 'please']
+        db.session.execute(insert(Message), [{
+            'conversation_id': conversation.id,
+            'sender_type': 'customer' if i % 3 else 'agent',
+            'sender_id': 'customer-0' if i % 3 else '1',
+            'message_text': ' '.join(rng.choice(words) for _ in range(rng.randint(3, 40))),
+            'timestamp': started_at + timedelta(seconds=i * 250),
+            'seq': i + 1
+        } for i in range(args.messages)])
+        db.session.commit()
+
+        messages = Message.query.filter_by(conversation_id=conversation.id).order_by(Message.seq).all()
+        flask_json = DefaultJSONProvider(app)
+        # (label, build the message dicts, encode them)
+        variants = [
+            ('hand-built + flask json', legacy_message_data, flask_json.dumps),
+            ('serializer + json', serializers.MESSAGE.many,
+             lambda data: json.dumps(data, separators=(',', ':'), ensure_ascii=False)),
+        ]
+        if serializers.orjson:
+            variants.append(('serializer + orjson', serializers.MESSAGE.many, serializers.dumps_bytes))
+
+        # Same fields and values apart from the conversation_id the shared message fields add
+        legacy = json.loads(flask_json.dumps(legacy_message_data(messages)))
+        shared = [{key: value for key, value in message.items() if key != 'conversation_id'}
+                  for message in serializers.loads(serializers.dumps(serializers.MESSAGE.many(messages)))]
+        ok = legacy == shared
+
+        print(f"{len(messages)} messages in one conversation, JSON backend {serializers.BACKEND}")
+        print(f"{'variant':<26} {'build ms':>9} {'encode ms':>10} {'total ms':>9} {'us/msg':>7} {'KiB':>7}")
+        for label, build, encode in variants:
+            build_ms, encode_ms = [], []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                data = build(messages)
+                built = time.perf_counter()
+                body = encode(data)
+                build_ms.append((built - started) * 1000)
+                encode_ms.append((time.perf_counter() - built) * 1000)
+            total = statistics.median([b + e for b, e in zip(build_ms, encode_ms)])
+            print(f"{label:<26} {statistics.median(build_ms):>9.2f} {statistics.median(encode_ms):>10.2f} "
+                  f"{total:>9.2f} {total * 1000 / len(messages):>7.2f} {len(body) / 1024:>7.1f}")
+        db.engine.dispose()
+
+    print('PASS' if ok else 'FAIL: serialized messages differ from the hand-built ones')
+    return 0 if ok else 1
+
+class QueryCounter:
+    """Count the SQL statements executed on an engine"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+def bench_queries(args):
+    """Count the queries of the dashboard and the conversation list for growing numbers of conversations"""
+    from app.fragments import fragment_cache
+
+    app = make_app(args.database_url, ARCHIVE_INTERVAL=0, LOG_LEVEL='ERROR')
+    sizes = sorted(set(args.conversations))
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        db.session.add(user)
+        db.session.flush()
+        page = FacebookPage(page_id='page-0', page_name='Page 0', access_token='token', user_id=user.id)
+        db.session.add(page)
+        db.session.commit()
+        user_id, page_id = user.id, page.id
+        counter = QueryCounter(db.engine)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    paths = {'dashboard': '/dashboard', 'conversation list': f"/api/conversations?limit={sizes[-1]}"}
+    results = {name: [] for name in paths}
+    created = 0
+    for size in sizes:
+        with app.app_context():
+            now = datetime.utcnow()
+            for n in range(created, size):
+                customer = Customer(fb_id=f"customer-{n}", name=f"Customer {n}", profile_pic='')
+                db.session.add(customer)
+                db.session.flush()
+                conversation = Conversation(fb_page_id=page_id, customer_id=customer.id, status='open',
+                                            message_count=1, unread_count=1, last_message_text=f"hello {n}",
+                                            last_message_at=now, last_sender_type='customer',
+                                            updated_at=now - timedelta(minutes=n))
+                db.session.add(conversation)
+                db.session.flush()
+                db.session.add(Message(conversation_id=conversation.id, sender_type='customer',
+                                       sender_id=customer.fb_id, message_text=f"hello {n}", timestamp=now, seq=1))
+            db.session.commit()
+            db.session.remove()
+        created = size
+
+        for name, path in paths.items():
+            # Every list item is rendered, not taken from the cache
+            fragment_cache.clear()
+            counter.count = 0
+            response = client.get(path)
+            results[name].append(counter.count)
+            if response.status_code != 200:
+                print(f"{name}: HTTP {response.status_code}")
+                results[name][-1] = None
+
+    ok = True
+    print(f"{'conversations':<18}" + ''.join(f"{size:>6}" for size in sizes))
+    for name, counts in results.items():
+        constant = None not in counts and len(set(counts)) == 1
+        ok = ok and constant
+        print(f"{name:<18}" + ''.join(f"{count if count is not None else '-':>6}" for count in counts) +
+              ('' if constant else '  (grows with the conversations)'))
+    with app.app_context():
+        db.engine.dispose()
+
+    print('PASS' if ok else 'FAIL: the number of queries depends on the number of conversations')
+    return 0 if ok else 1
+
+def bench_archive(args):
+    """Archive cold conversations, backfill the summaries, open one and reply, checking the sequence carries on"""
+    from app import archive, search
+    from fake_graph import FakeGraphServer
+
+    graph_server = FakeGraphServer().start()
+    app = make_app(args.database_url, GRAPH_API_URL=graph_server.url, ARCHIVE_INTERVAL=0, LOG_LEVEL='ERROR')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        db.session.add(user)
+        db.session.flush()
+        page = FacebookPage(page_id='page-0', page_name='Page 0', access_token='token', user_id=user.id)
+        db.session.add(page)
+        db.session.flush()
+        started_at = datetime.utcnow() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'] + 30)
+        for n in range(args.conversations):
+            customer = Customer(fb_id=f"customer-{n}", name=f"Customer {n}", profile_pic='')
+            db.session.add(customer)
+            db.session.flush()
+            conversation = Conversation(fb_page_id=page.id, customer_id=customer.id, status='open',
+                                        message_count=args.messages, last_message_text='hello',
+                                        last_sender_type='customer', updated_at=started_at)
+            db.session.add(conversation)
+            db.session.flush()
+            db.session.execute(insert(Message), [{
+                'conversation_id': conversation.id,
+                'sender_type': 'customer',
+                'sender_id': customer.fb_id,
+                'message_text': f"message {i}",
+                'timestamp': started_at - timedelta(minutes=args.messages - i),
+                'seq': i + 1
+            } for i in range(args.messages)])
+        db.session.commit()
+        # The messages were inserted behind the search index's back
+        search.rebuild()
+        user_id, conversation_id = user.id, conversation.id
+
+        archived = archive.archive_cold_conversations()
+        backfill = app.test_cli_runner().invoke(args=['backfill-summaries'])
+        summary = db.session.get(Conversation, conversation_id).message_count
+        db.session.remove()
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    # The newest conversation opens with the dashboard, which restores it too
+    dashboard = client.get('/dashboard').get_data(as_text=True)
+    last_seq = dashboard.split('data-last-seq="', 1)[-1].split('"', 1)[0]
+    opened = client.get(f"/api/conversation/{conversation_id}?limit={args.messages}")
+    reply = client.post('/api/send-message', json={
+        'conversation_id': conversation_id, 'message': 'back again', 'user_id': str(user_id)})
+    graph_server.stop()
+
+    with app.app_context():
+        seqs = [seq for (seq,) in db.session.query(Message.seq).filter_by(conversation_id=conversation_id)
+                .order_by(Message.seq)]
+        db.engine.dispose()
+
+    checks = {
+        'conversations archived': (archived, args.conversations),
+        'backfill exit code': (backfill.exit_code, 0),
+        'message_count after backfill': (summary, args.messages),
+        'dashboard last seq': (last_seq, str(args.messages)),
+        'messages restored': (len(opened.get_json().get('messages', [])), args.messages),
+        'reply status': (reply.status_code, 202),
+        'sequence after reply': (seqs, list(range(1, args.messages + 2)))
+    }
+    ok = True
+    for name, (got, wanted) in checks.items():
+        ok = ok and got == wanted
+        shown = f"{got[0]}..{got[-1]} ({len(got)})" if isinstance(got, list) and got else got
+        print(f"{name}: {shown}{'' if got == wanted else ' (wrong)'}")
+    if reply.status_code != 202:
+        print(f"reply: {reply.get_json()}")
+
+    print('PASS' if ok else 'FAIL')
+    return 0 if ok else 1
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the helpdesk database hot paths')
+    parser.add_argument('--database-url', help='database to use (default: SQLite in a temporary directory)')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    indexes = subparsers.add_parser('indexes', help='query plans and latencies with and without indexes')
+    indexes.add_argument('--messages', type=int, default=1000000)
+    indexes.add_argument('--customers', type=int, default=20000)
+    indexes.add_argument('--repeat', type=int, default=50)
+    indexes.set_defaults(run=bench_indexes)
+
+    race = subparsers.add_parser('race', help='parallel events from one sender create one customer and conversation')
+    race.add_argument('--workers', type=int, default=8)
+    race.add_argument('--events', type=int, default=5, help='events per worker')
+    race.add_argument('--attempts', type=int, default=20, help='deliveries tried per event when the database is busy')
+    race.set_defaults(run=bench_race)
+
+    scaleout = subparsers.add_parser('scaleout', help='Socket.IO emits reach clients of another server process')
+    scaleout.add_argument('--message-queue', help='queue URL (default: SQLite in a temporary directory)')
+    scaleout.add_argument('--messages', type=int, default=20)
+    scaleout.set_defaults(run=bench_scaleout)
+
+    throttle = subparsers.add_parser('throttle', help='per-page send budgets and fair scheduling of outbound replies')
+    throttle.add_argument('--pages', type=int, default=4, help='one busy page and the rest quiet')
+    throttle.add_argument('--busy', type=int, default=200, help='replies on the busy page')
+    throttle.add_argument('--quiet', type=int, default=10, help='replies on each quiet page')
+    throttle.add_argument('--workers', type=int, default=4)
+    throttle.add_argument('--rate', type=float, default=20, help='limiter sends per second per page')
+    throttle.add_argument('--burst', type=int, default=5)
+    throttle.add_argument('--graph-page-rate', type=int, default=25, help='sends per second the fake Graph allows a page')
+    throttle.add_argument('--rate-limit-every', type=int, default=0, help='also rate-limit every Nth Graph request')
+    throttle.add_argument('--timeout', type=float, default=120)
+    throttle.set_defaults(run=bench_throttle)
+
+    writes = subparsers.add_parser('writes', help='concurrent webhook write throughput with the plain and tuned database profiles')
+    writes.add_argument('--writers', type=int, default=8)
+    writes.add_argument('--readers', type=int, default=2, help='threads listing conversations meanwhile')
+    writes.add_argument('--events', type=int, default=50, help='events per writer')
+    writes.add_argument('--attempts', type=int, default=20, help='deliveries tried per event when the database is busy')
+    writes.set_defaults(run=bench_writes)
+
+    serialize = subparsers.add_parser('serialize', help='JSON serialization cost of a long conversation')
+    serialize.add_argument('--messages', type=int, default=10000)
+    serialize.add_argument('--repeat', type=int, default=20)
+    serialize.set_defaults(run=bench_serialize)
+
+    queries = subparsers.add_parser('queries', help='dashboard and conversation list queries do not grow with the list')
+    queries.add_argument('--conversations', type=int, nargs='+', default=[5, 25, 50],
+                         help='list sizes to compare, up to the page size')
+    queries.set_defaults(run=bench_queries)
+
+    archive = subparsers.add_parser('archive', help='archived conversations survive a summary backfill and restore')
+    archive.add_argument('--conversations', type=int, default=3)
+    archive.add_argument('--messages', type=int, default=20, help='messages per conversation')
+    archive.set_defaults(run=bench_archive)
+
+    args = parser.parse_args()
+    if not args.database_url:
+        args.database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    return args.run(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,8 +16,106 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         f'sqlite:///{os.path.join(instance_path, "app.db")}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # Engine tuning: 'auto' picks settings for the database in use, 'plain' keeps driver defaults
+    DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'auto')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    
     FB_APP_ID = os.environ.get('FB_APP_ID')
     FB_APP_SECRET = os.environ.get('FB_APP_SECRET')
     FB_REDIRECT_URI = os.environ.get('FB_REDIRECT_URI') or 'http://localhost:5001/integration/callback'
     FB_WEBHOOK_VERIFY_TOKEN = os.environ.get('FB_WEBHOOK_VERIFY_TOKEN') or 'my_webhook_token'
     FB_PAGE_TOKEN = os.environ.get('FB_PAGE_TOKEN')
+    
+    # Structured logging; LOG_SAMPLE_RATES keeps a fraction of a category's info and debug events
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', 'webhook:0.1,socket:0.1')
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    LOG_PAYLOAD_MAX = int(os.environ.get('LOG_PAYLOAD_MAX', 512))
+    
+    # Bearer token required to scrape /metrics (unset disables the endpoint)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Webhook ingestion queue (0 workers processes payloads inline)
+    WEBHOOK_QUEUE_WORKERS = int(os.environ.get('WEBHOOK_QUEUE_WORKERS', 2))
+    WEBHOOK_QUEUE_POLL_INTERVAL = float(os.environ.get('WEBHOOK_QUEUE_POLL_INTERVAL', 5))
+    WEBHOOK_QUEUE_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_QUEUE_MAX_ATTEMPTS', 3))
+    WEBHOOK_QUEUE_STALE_AFTER = int(os.environ.get('WEBHOOK_QUEUE_STALE_AFTER', 300))
+    WEBHOOK_QUEUE_RETRY_BACKOFF = float(os.environ.get('WEBHOOK_QUEUE_RETRY_BACKOFF', 5))
+    
+    # Webhook bodies must carry a valid X-Hub-Signature-256 made with FB_APP_SECRET
+    WEBHOOK_REQUIRE_SIGNATURE = os.environ.get('WEBHOOK_REQUIRE_SIGNATURE', 'true').lower() in ('true', '1', 'yes')
+    WEBHOOK_MAX_BODY_BYTES = int(os.environ.get('WEBHOOK_MAX_BODY_BYTES', 1024 * 1024))
+    
+    # Message ids of recently stored webhook messages, checked before the database
+    WEBHOOK_DEDUPE_SIZE = int(os.environ.get('WEBHOOK_DEDUPE_SIZE', 100000))
+    WEBHOOK_DEDUPE_TTL = int(os.environ.get('WEBHOOK_DEDUPE_TTL', 3600))
+    
+    # Message search: words used from a query and words shown around a match
+    SEARCH_MAX_TERMS = int(os.environ.get('SEARCH_MAX_TERMS', 8))
+    SEARCH_SNIPPET_WORDS = int(os.environ.get('SEARCH_SNIPPET_WORDS', 12))
+    
+    # Retention: messages of conversations idle this many days (closed ones sooner) move to the archive
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+    ARCHIVE_CLOSED_AFTER_DAYS = int(os.environ.get('ARCHIVE_CLOSED_AFTER_DAYS', 30))
+    ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL', 3600))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 100))
+    
+    # Identity cache for pages, customers and conversations on the hot path
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 300))
+    IDENTITY_CACHE_CHECK_INTERVAL = float(os.environ.get('IDENTITY_CACHE_CHECK_INTERVAL', 5))
+    
+    # Rendered conversation list items; a redis:// FRAGMENT_CACHE_URL shares them between processes
+    FRAGMENT_CACHE_URL = os.environ.get('FRAGMENT_CACHE_URL')
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+    
+    # Facebook Graph API client
+    GRAPH_API_URL = os.environ.get('GRAPH_API_URL') or 'https://graph.facebook.com'
+    GRAPH_API_VERSION = os.environ.get('GRAPH_API_VERSION') or 'v18.0'
+    GRAPH_POOL_SIZE = int(os.environ.get('GRAPH_POOL_SIZE', 10))
+    GRAPH_CONNECT_TIMEOUT = float(os.environ.get('GRAPH_CONNECT_TIMEOUT', 3.05))
+    GRAPH_READ_TIMEOUT = float(os.environ.get('GRAPH_READ_TIMEOUT', 10))
+    GRAPH_MAX_RETRIES = int(os.environ.get('GRAPH_MAX_RETRIES', 3))
+    GRAPH_BACKOFF_BASE = float(os.environ.get('GRAPH_BACKOFF_BASE', 0.5))
+    GRAPH_BACKOFF_MAX = float(os.environ.get('GRAPH_BACKOFF_MAX', 8))
+    
+    # Background customer profile enrichment (0 workers fetches inline)
+    PROFILE_ENRICH_WORKERS = int(os.environ.get('PROFILE_ENRICH_WORKERS', 2))
+    PROFILE_ENRICH_RETRY_AFTER = int(os.environ.get('PROFILE_ENRICH_RETRY_AFTER', 300))
+    
+    # Outbound send workers for agent replies (0 workers sends inline)
+    OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 4))
+    OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 5))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+    OUTBOX_RETRY_BACKOFF = float(os.environ.get('OUTBOX_RETRY_BACKOFF', 1))
+    OUTBOX_STALE_AFTER = int(os.environ.get('OUTBOX_STALE_AFTER', 300))
+    
+    # Per-page send budget; OUTBOX_PAGE_RATES overrides it as "page_id:rate,..."
+    OUTBOX_PAGE_RATE = float(os.environ.get('OUTBOX_PAGE_RATE', 10))
+    OUTBOX_PAGE_BURST = int(os.environ.get('OUTBOX_PAGE_BURST', 20))
+    OUTBOX_PAGE_RATES = os.environ.get('OUTBOX_PAGE_RATES', '')
+    
+    # Cursor pagination for conversation lists and message history
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+    API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 200))
+    
+    # Window for coalescing real-time updates per room into one frame (0 sends each at once)
+    REALTIME_BATCH_WINDOW_MS = int(os.environ.get('REALTIME_BATCH_WINDOW_MS', 50))
+    # Most messages replayed to a reconnecting agent before the client reloads the conversation instead
+    REALTIME_REPLAY_LIMIT = int(os.environ.get('REALTIME_REPLAY_LIMIT', 200))
+    
+    # Socket.IO message queue shared by every server process so emits reach clients
+    # connected to any of them: redis://localhost:6379/0, a Kombu URL (amqp://...) or
+    # sqlite:////path/queue.db for several processes on one machine. Leave unset when
+    # running a single process.
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL') or 'flask-socketio'
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Facebook Graph API.
+
+Answers the Graph endpoints the helpdesk uses with canned data so the app can
+be exercised offline. Point the app at it with GRAPH_API_URL:
+
+    python fake_graph.py --port 5002
+    GRAPH_API_URL=http://127.0.0.1:5002 python run.py
+
+It can also be started in-process for scripted checks:
+
+    with FakeGraphServer(fail_rate=0.2) as server:
+        ...  # server.url, server.requests
+
+With page_rate set, each page's access token may send that many messages in
+any one second; further sends get Facebook's #613 rate-limit error.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+class FakeGraphServer:
+    """Threaded fake Graph server with optional latency and failure injection"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0, rate_limit_every=0, page_rate=0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rate_limit_every = rate_limit_every
+        self.page_rate = page_rate
+        self.requests = []
+        self.sends = defaultdict(list)
+        self._recent_sends = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def respond(self, method, path, params, body):
+        """Return (status, headers, payload) for a request"""
+        with self._lock:
+            self.requests.append((method, path, params, body))
+            count = len(self.requests)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.rate_limit_every and count % self.rate_limit_every == 0:
+            return self._rate_limited()
+
+        parts = [part for part in path.split('/') if part]
+        if parts and parts[0].startswith('v') and parts[0][1:2].isdigit():
+            parts = parts[1:]
+
+        if parts == ['me', 'messages'] and method == 'POST' and not self._allow_send(params.get('access_token')):
+            return self._rate_limited()
+
+        if self.fail_rate and random.random() < self.fail_rate:
+            return 500, {}, {'error': {'message': 'An unknown error has occurred.', 'code': 1}}
+
+        if parts == ['me', 'messages'] and method == 'POST':
+            recipient = (body or {}).get('recipient', {}).get('id')
+            return 200, {}, {'recipient_id': recipient, 'message_id': f"m_{uuid.uuid4().hex}"}
+
+        if parts == ['oauth', 'access_token']:
+            return 200, {}, {'access_token': f"fake-token-{uuid.uuid4().hex[:8]}", 'token_type': 'bearer'}
+
+        if parts == ['me', 'accounts']:
+            return 200, {}, {'data': [{'id': '1000', 'name': 'Fake Page', 'access_token': 'fake-page-token'}]}
+
+        if len(parts) == 2 and parts[1] == 'subscribed_apps':
+            return 200, {}, {'success': True}
+
+        if len(parts) == 1 and method == 'GET':
+            return 200, {}, {'id': parts[0], 'name': f"Test User {parts[0][-4:]}", 'profile_pic': ''}
+
+        return 404, {}, {'error': {'message': f"Unknown path {path}", 'code': 803}}
+
+    def _allow_send(self, token):
+        """Record a send for the token's page, unless it is over page_rate in the last second"""
+        now = time.monotonic()
+        with self._lock:
+            recent = self._recent_sends[token]
+            while recent and recent[0] <= now - 1:
+                recent.popleft()
+            if self.page_rate and len(recent) >= self.page_rate:
+                return False
+            recent.append(now)
+            self.sends[token].append(now)
+            return True
+
+    def _rate_limited(self):
+        return 429, {'Retry-After': '1'}, {'error': {
+            'message': '(#613) Calls to this api have exceeded the rate limit.',
+            'type': 'OAuthException',
+            'code': 613
+        }}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                parsed = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                if self.headers.get('Content-Type', '').startswith('application/json') and raw:
+                    body = json.loads(raw)
+                else:
+                    body = {key: values[0] for key, values in parse_qs(raw.decode()).items()}
+
+                status, headers, payload = server.respond(self.command, parsed.path, params, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_DELETE = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a fake Facebook Graph API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5002)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before answering')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of requests answered with a 500')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth request with a rate-limit error')
+    parser.add_argument('--page-rate', type=int, default=0, help='sends per second allowed for each page token')
+    args = parser.parse_args()
+
+    server = FakeGraphServer(args.host, args.port, args.latency, args.fail_rate, args.rate_limit_every, args.page_rate)
+    print(f"Fake Graph API listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
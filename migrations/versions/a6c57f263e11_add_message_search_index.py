@@ -0,0 +1,42 @@
+"""add message search index
+
+Revision ID: a6c57f263e11
+Revises: 19e22f7cb9e4
+Create Date: 2026-10-18 16:50:54.863898
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c57f263e11'
+down_revision = '19e22f7cb9e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Each database gets its own full-text index on message_text
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE message_search USING fts5("
+            "message_text, content='message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+        op.execute("INSERT INTO message_search(message_search) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.execute(
+            "CREATE INDEX ix_message_text_search ON message "
+            "USING gin (to_tsvector('simple', coalesce(message_text, '')))"
+        )
+    elif dialect == 'mysql':
+        op.create_index('ix_message_text_search', 'message', ['message_text'], mysql_prefix='FULLTEXT')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TABLE message_search")
+    elif dialect in ('postgresql', 'mysql'):
+        op.drop_index('ix_message_text_search', table_name='message')
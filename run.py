@@ -1,5 +1,5 @@
 from app import create_app, db, socketio
-from app.models import User, FacebookPage, Customer, Conversation, Message
+from app.models import User, FacebookPage, Customer, Conversation, Message, WebhookEvent
 
 app = create_app()
 
@@ -11,7 +11,8 @@ def make_shell_context():
         'FacebookPage': FacebookPage,
         'Customer': Customer,
         'Conversation': Conversation,
-        'Message': Message
+        'Message': Message,
+        'WebhookEvent': WebhookEvent
     }
 
 if __name__ == '__main__':
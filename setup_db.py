@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os
 import sys
+from flask_migrate import stamp
 from app import create_app, db
 from app.models import User, FacebookPage, Customer, Conversation, Message
 
@@ -48,6 +49,10 @@ def init_db():
             db.create_all()
             print("Database tables created successfully!")
             
+            # Record the schema as current so later migrations apply cleanly
+            print("Stamping database with the latest migration...")
+            stamp(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
+            
             # Create admin user
             print("Creating admin user...")
             admin = User(
@@ -54,6 +54,7 @@ def store_page_token():
             )
             db.session.add(new_page)
         
+        # Running servers see the page's new updated_at and reload it within IDENTITY_CACHE_CHECK_INTERVAL seconds
         db.session.commit()
         print(f"Successfully stored/updated token for page: {page_name}")
         print("You can now restart your application and start using the Facebook Helpdesk!")